@@ -0,0 +1,125 @@
+"""
+Compare per-post calculate_keyword_scores with batched keyword scoring at 10k posts x 30 keywords.
+
+Two batched variants were tried for score_posts and rejected; they live here so
+the measurement can be repeated:
+
+- presence matrix: lowercase each text once, one str.__contains__ pass per
+  distinct keyword over the batch
+- concatenated corpus: one str.find scan per keyword over the NUL-joined
+  corpus, hit offsets mapped back to posts with bisect
+
+All three must return identical scores. The last column times a bare
+corpus.count() per keyword, the cost of the substring scan alone.
+
+Measured (best of 5):
+  short posts (2.2M chars):  per-post 108 ms, presence matrix 123 ms, concatenated 81 ms, scan only 65 ms
+  long posts (14.1M chars):  per-post 409 ms, presence matrix 404 ms, concatenated 400 ms, scan only 375 ms
+The scan dominates: the concatenated corpus saves ~25 ms on short posts and
+nothing measurable on long ones, where the time goes, so score_posts keeps the
+per-post loop. A real speedup needs a multi-pattern matcher (Aho-Corasick).
+
+    python -m help.bench_keyword_scores
+"""
+import random
+import string
+import time
+from bisect import bisect_right
+from itertools import repeat
+
+import numpy as np
+
+from utils.posts import calculate_keyword_scores
+
+N_POSTS = 10_000
+KEYWORDS = [
+    "crm", "sales", "marketing automation", "lead gen", "saas", "ai tools", "growth", "startup", "founder",
+    "pricing", "customer success", "cold email", "outreach", "seo", "content marketing", "b2b", "churn",
+    "onboarding", "analytics", "product hunt", "landing page", "conversion", "funnel", "ads", "newsletter",
+    "cac", "ltv", "pipeline", "hubspot", "salesforce",
+]
+
+
+def make_texts(n, min_words, max_words):
+    rnd = random.Random(0)
+    vocab = ["".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 9))) for _ in range(20_000)]
+    texts = []
+    for _ in range(n):
+        words = [rnd.choice(vocab) for _ in range(rnd.randint(min_words, max_words))]
+        for _ in range(rnd.randint(0, 3)):
+            words.insert(rnd.randrange(len(words)), rnd.choice(KEYWORDS).title())
+        texts.append(" ".join(words).capitalize())
+    return texts
+
+
+def per_post(texts, primary, secondary):
+    scores = [calculate_keyword_scores(text, primary, secondary) for text in texts]
+    return np.array([s[0] for s in scores]), np.array([s[1] for s in scores])
+
+
+def presence_matrix(texts, keywords):
+    lowered = [text.lower() for text in texts]
+    rows = {kw: i for i, kw in enumerate(dict.fromkeys(kw.lower() for kw in keywords))}
+    presence = np.empty((len(rows), len(lowered)), dtype=bool)
+    for kw, i in rows.items():
+        presence[i] = np.fromiter(map(str.__contains__, lowered, repeat(kw)), dtype=bool, count=len(lowered))
+    return presence, rows
+
+
+def concatenated(texts, keywords):
+    lowered = [text.lower() for text in texts]
+    corpus = "\x00".join(lowered)
+    starts, ends, offset = [], [], 0
+    for text in lowered:
+        starts.append(offset)
+        ends.append(offset + len(text))
+        offset += len(text) + 1
+    rows = {kw: i for i, kw in enumerate(dict.fromkeys(kw.lower() for kw in keywords))}
+    presence = np.zeros((len(rows), len(lowered)), dtype=bool)
+    for kw, i in rows.items():
+        pos = corpus.find(kw)
+        while pos != -1:
+            post = bisect_right(starts, pos) - 1
+            presence[i, post] = True
+            # One hit per post is enough; resume at the next post
+            pos = corpus.find(kw, ends[post] + 1)
+    return presence, rows
+
+
+def batched(presence_fn):
+    def score(texts, primary, secondary):
+        presence, rows = presence_fn(texts, primary + secondary)
+        primary_scores = presence[[rows[kw.lower()] for kw in primary]].sum(axis=0) / len(primary)
+        secondary_scores = presence[[rows[kw.lower()] for kw in secondary]].sum(axis=0) / len(secondary)
+        return primary_scores, secondary_scores
+    return score
+
+
+def scan_only(texts, primary, secondary):
+    corpus = "\x00".join(text.lower() for text in texts)
+    return [corpus.count(kw) for kw in primary + secondary]
+
+
+def measure(fn, texts, primary, secondary, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(texts, primary, secondary)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    primary, secondary = KEYWORDS[:10], KEYWORDS[10:]
+    for label, (min_words, max_words) in {"short posts": (5, 60), "long posts": (30, 400)}.items():
+        texts = make_texts(N_POSTS, min_words, max_words)
+        chars = sum(map(len, texts)) / 1e6
+        print(f"{label}: {N_POSTS} posts, {len(KEYWORDS)} keywords, {chars:.1f}M chars")
+        base_time, base_scores = measure(per_post, texts, primary, secondary)
+        print(f"  per-post calculate_keyword_scores: {base_time * 1000:.1f} ms")
+        for name, fn in {"presence matrix": batched(presence_matrix), "concatenated corpus": batched(concatenated)}.items():
+            elapsed, scores = measure(fn, texts, primary, secondary)
+            assert all(np.array_equal(a, b) for a, b in zip(base_scores, scores))
+            print(f"  {name + ':':34} {elapsed * 1000:.1f} ms")
+        elapsed, _ = measure(scan_only, texts, primary, secondary)
+        print(f"  {'scan only (corpus.count):':34} {elapsed * 1000:.1f} ms")
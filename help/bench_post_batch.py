@@ -0,0 +1,87 @@
+"""
+Compare the old list-of-dicts -> DataFrame -> records path with PostBatch on a 10k-post run.
+
+Only the representation work is measured (building posts, attaching scores,
+filtering, sorting and building the response lists); TF-IDF is identical in both.
+
+    python -m help.bench_post_batch
+"""
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.post_batch import Post, PostBatch
+
+N_POSTS = 10_000
+WORDS = "ai tools marketing automation crm sales lead gen reddit growth saas startup founder product".split()
+
+
+def make_raw(n):
+    rnd = random.Random(0)
+    return [{
+        "id": f"p{i}",
+        "title": " ".join(rnd.choice(WORDS) for _ in range(8)),
+        "body": " ".join(rnd.choice(WORDS) for _ in range(120)),
+        "permalink": f"/r/sub/comments/p{i}",
+        "score": rnd.randint(0, 500),
+        "created_utc": 1_700_000_000 + i,
+        "num_comments": rnd.randint(0, 50),
+        "subreddit": f"sub{i % 50}",
+        "author": f"user{i}",
+    } for i in range(n)]
+
+
+def legacy(raw, scores, k):
+    posts = [{
+        "id": r["id"], "title": r["title"], "body": r["body"],
+        "url": f"https://reddit.com{r['permalink']}", "score": r["score"],
+        "created_utc": datetime.fromtimestamp(r["created_utc"]), "num_comments": r["num_comments"],
+        "subreddit": r["subreddit"], "author": r["author"],
+    } for r in raw]
+    posts_text = [f"{post['title']} {post['body']}" for post in posts]
+    df = pd.DataFrame(posts)
+    df["similarity_score"] = scores
+    df["primary_score"] = scores
+    df["secondary_score"] = scores
+    df = df[df["similarity_score"] >= 0.1].sort_values(by=["similarity_score", "score"], ascending=[False, False])
+    results = df.astype(object).to_dict(orient="records")
+    return posts_text, [[o["id"], o["subreddit"], o["title"], o["body"], "x", o["url"], o["created_utc"]] for o in results[:k]]
+
+
+def batched(raw, scores, k):
+    batch = PostBatch(Post(
+        id=r["id"], title=r["title"], body=r["body"], url=f"https://reddit.com{r['permalink']}",
+        score=r["score"], created_utc=datetime.fromtimestamp(r["created_utc"]), num_comments=r["num_comments"],
+        subreddit=r["subreddit"], author=r["author"],
+    ) for r in raw)
+    posts_text = batch.texts()
+    batch.set_scores(scores, scores, scores)
+    return posts_text, batch.filter(0.1).sorted().to_reddit_objects(k, "x")
+
+
+def measure(fn, raw, scores, k=20, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(raw, scores, k)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn(raw, scores, k)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+if __name__ == "__main__":
+    raw = make_raw(N_POSTS)
+    scores = np.random.default_rng(0).random(N_POSTS)
+    legacy_time, legacy_peak, legacy_result = measure(legacy, raw, scores)
+    batch_time, batch_peak, batch_result = measure(batched, raw, scores)
+    assert [row[0] for row in legacy_result[1]] == [row[0] for row in batch_result[1]]
+    print(f"{N_POSTS} posts")
+    print(f"legacy dict/DataFrame: {legacy_time * 1000:.1f} ms, peak {legacy_peak / 2**20:.1f} MiB")
+    print(f"PostBatch:             {batch_time * 1000:.1f} ms, peak {batch_peak / 2**20:.1f} MiB")
@@ -0,0 +1,69 @@
+"""
+Run reply pre-generation against local stubs: no Claude, Pinecone or Firestore calls.
+
+The stub generator sleeps for a typical reply latency and records how many
+generations are in flight, so the run shows the concurrency bound holding and
+the wall clock dropping from posts * latency to posts * latency / concurrency.
+Failed generations must keep the placeholder (never be written back).
+
+    python -m help.bench_reply_pregen
+"""
+import asyncio
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.reply_pregen import PLACEHOLDER_REPLY, pregenerate_replies
+
+N_USERS = 20
+POSTS_PER_USER = 5
+LATENCY_SECONDS = 0.2
+FAILURE_RATE = 0.1
+
+
+class StubService:
+    def __init__(self):
+        self.replies = []
+
+    async def get_user_profile(self, user_id):
+        return SimpleNamespace(company_name=f"company {user_id}", company_description="", user_role=None,
+                               sample_reply=None, marketing_goals=None)
+
+    async def set_suggested_replies(self, replies):
+        self.replies.extend(replies)
+        return [{"size": len(replies), "attempts": 1, "seconds": 0.0, "error": None}]
+
+
+async def stub_prompt(profile, user_id, title, content):
+    return profile.company_name, f"{title} {content}"
+
+
+def stub_generator(rnd, in_flight, peak):
+    async def generate(system_prompt, user_prompt):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        try:
+            await asyncio.sleep(LATENCY_SECONDS)
+        finally:
+            in_flight[0] -= 1
+        if rnd.random() < FAILURE_RATE:
+            return "Error getting summary: stub failure"
+        return f"reply to {user_prompt}"
+    return generate
+
+
+async def main():
+    posts = [(f"user{u}", [f"p{u}_{i}", "sub", f"title {i}", "body", PLACEHOLDER_REPLY, "url", datetime.now()])
+             for u in range(N_USERS) for i in range(POSTS_PER_USER)]
+    for concurrency in (1, 8, 32):
+        service, in_flight, peak = StubService(), [0], [0]
+        stats = await pregenerate_replies(posts, service, concurrency=concurrency, prompt=stub_prompt,
+                                          generate=stub_generator(random.Random(0), in_flight, peak))
+        assert peak[0] <= concurrency
+        assert all(not reply.startswith("Error") for _, _, reply in service.replies)
+        assert stats["drafted"] + stats["failed"] == len(posts) and stats["drafted"] == len(service.replies)
+        print(f"concurrency {concurrency:>2}: {stats}, peak in flight {peak[0]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""
+Compare full filter-and-sort with the bounded-heap PostBatch.top on 10k scored posts.
+
+Both must return the same k posts in the same order, including ties.
+
+    python -m help.bench_top_k
+"""
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from utils.post_batch import Post, PostBatch
+
+N_POSTS = 10_000
+
+
+def make_batch(n):
+    rnd = random.Random(0)
+    posts = []
+    for i in range(n):
+        post = Post(f"p{i}", "title", "body", f"https://reddit.com/p{i}", rnd.randint(0, 20),
+                    datetime.fromtimestamp(1_700_000_000 + i), 0, f"sub{i % 50}")
+        # Coarse scores so ties on similarity and on (similarity, score) are common
+        post.similarity_score = round(rnd.random(), 2)
+        posts.append(post)
+    return PostBatch(posts)
+
+
+def measure(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+if __name__ == "__main__":
+    batch = make_batch(N_POSTS)
+    for k in (5, 20):
+        full_time, full_peak, full = measure(lambda: batch.filter(0.1).sorted()[:k])
+        top_time, top_peak, top = measure(lambda: batch.top(k, 0.1))
+        assert [p.id for p in full] == [p.id for p in top]
+        print(f"{N_POSTS} posts, k={k}")
+        print(f"  filter + sort: {full_time * 1000:.2f} ms, peak {full_peak / 1024:.0f} KiB")
+        print(f"  heap top-k:    {top_time * 1000:.2f} ms, peak {top_peak / 1024:.0f} KiB")
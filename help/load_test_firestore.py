@@ -0,0 +1,65 @@
+"""
+Check that Firestore-heavy requests no longer stall unrelated endpoints.
+
+Probes GET / (no I/O) at a fixed rate, first on an idle server and then while
+CONCURRENCY clients hammer GET /query_plan (a profile read and nothing else).
+Before the AsyncClient change every Firestore round trip blocked the event
+loop, so the probe p99 grew with the background load. It should now stay flat.
+
+    uvicorn main:app --port 8000
+    python -m help.load_test_firestore http://localhost:8000 <userid>
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+import numpy as np
+
+DURATION_SECONDS = 20
+PROBE_INTERVAL = 0.05
+CONCURRENCY = 32
+
+
+async def probe(session, base_url, stop):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        async with session.get(f"{base_url}/") as response:
+            await response.read()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PROBE_INTERVAL)
+    return latencies
+
+
+async def hammer(session, base_url, userid, stop, counts):
+    while not stop.is_set():
+        async with session.get(f"{base_url}/query_plan", params={"userid": userid}) as response:
+            await response.read()
+            counts[response.status] = counts.get(response.status, 0) + 1
+
+
+async def run(base_url, userid, background):
+    stop = asyncio.Event()
+    counts = {}
+    async with aiohttp.ClientSession() as session:
+        probe_task = asyncio.create_task(probe(session, base_url, stop))
+        workers = [asyncio.create_task(hammer(session, base_url, userid, stop, counts))
+                   for _ in range(CONCURRENCY if background else 0)]
+        await asyncio.sleep(DURATION_SECONDS)
+        stop.set()
+        latencies = await probe_task
+        await asyncio.gather(*workers, return_exceptions=True)
+    ms = np.array(latencies) * 1000
+    label = f"with {CONCURRENCY} /query_plan clients" if background else "idle"
+    print(f"{label:>28}: probe p50 {np.percentile(ms, 50):6.1f} ms, p99 {np.percentile(ms, 99):6.1f} ms, "
+          f"max {ms.max():6.1f} ms, background responses {counts}")
+
+
+async def main(base_url, userid):
+    await run(base_url, userid, background=False)
+    await run(base_url, userid, background=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1].rstrip("/"), sys.argv[2]))
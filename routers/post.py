@@ -1,15 +1,32 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional
-import pandas as pd
-from utils.posts import find_relevant_posts, split_csv_string
-from utils.firestore_service import FirestoreService
+from utils.posts import find_relevant_posts, score_posts, split_csv_string
+from utils.query_planner import plan_queries
+from utils.firestore_service import FirestoreService, PendingWrites, stored_users
+from utils.search_cache import search_cache
+from utils.rules import rule_stats
+from utils.corpus_idf import corpus_idf
+from utils.semantic_rank import semantic_ranker
+from utils.reddit_pool import RateLimitExhausted, count_requests, wait_for_quota
+from utils.work_queue import WorkQueue
 from utils.finder import filter_best_subreddits, get_hot_posts, get_rising_posts
+from utils.llm_cache import llm_cache
+from utils.reply_pregen import REPLY_PREGEN, pregenerate_replies
 # from utils.post_scoring import final_df
 
 firestore_service = FirestoreService()
 router = APIRouter()
 
+# Users processed at once by the nightly job, and how long one user may take
+CRON_CONCURRENCY = int(os.getenv("CRON_CONCURRENCY", "4"))
+CRON_USER_TIMEOUT = float(os.getenv("CRON_USER_TIMEOUT", "300"))
+
 class KeywordsInput(BaseModel):
     primary_keywords: List[str]
     secondary_keywords: List[str]
@@ -21,10 +38,16 @@ async def get_relevant_posts(userid):
     # Get keywords from Firestore
     # keywords = await firestore_service.get_keywords(user_id=userid)
     # keywords = split_csv_string(keywords)
-    primary = await firestore_service.get_primary_keywords(user_id=userid)
-    secondary = await firestore_service.get_secondary_keywords(user_id=userid)
-    excluded_subs = await firestore_service.get_excluded_reddits(user_id=userid)
-    reddit_posts = await firestore_service.get_user_posts(user_id=userid)
+    profile, seen = await asyncio.gather(
+        firestore_service.get_user_profile(user_id=userid),
+        firestore_service.get_seen_index(user_id=userid),
+    )
+    reddit_posts = seen.ids
+    primary = profile.primary_keywords
+    secondary = profile.secondary_keywords
+    excluded_subs = profile.excluded_subreddits
+    query_history = profile.query_history.get("month", {})
+    company_description = profile.company_description
     primary = primary.split(',')
     secondary = secondary.split(',')
     keywords = KeywordsInput(
@@ -34,22 +57,23 @@ async def get_relevant_posts(userid):
     #reply_list = []
     try:
         # Find relevant posts
-        results_df = find_relevant_posts(
+        results = find_relevant_posts(
             primary_keywords=keywords.primary_keywords,
             secondary_keywords=keywords.secondary_keywords,
             limit=keywords.limit,
             min_similarity=keywords.min_similarity,
             excluded_subs=excluded_subs, 
             reddit_posts=reddit_posts,
-            duration="month"
+            duration="month",
+            query_history=query_history,
+            semantic_query=company_description,
+            top_k=20
         )
+        await save_query_history(userid, query_history, "month")
         
-        if results_df.empty:
+        if results.empty:
             return []
 
-        # Convert DataFrame to list of dictionaries for response
-        results = results_df.astype(object).to_dict(orient="records")
-
         # id
         # subreddit
         # title
@@ -64,35 +88,73 @@ async def get_relevant_posts(userid):
         for i in range(iter):
             obj = results[i] #victim of the crime
             llm_reply = "Add your reply here"
-            reddit_object = [obj["id"], obj["subreddit"], obj["title"], obj["body"], llm_reply, obj["url"], obj["created_utc"]]
+            reddit_object = obj.to_reddit_object(llm_reply)
             reply_list.append(reddit_object)
             
-        company_description = await firestore_service.get_company_description(user_id=userid)
         # reply_list = final_df(reply_list, company_description)
         # print(reply_list)
 
         return reply_list
         #return results
 
+    except RateLimitExhausted as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error occurred: {str(e)}")
     
 
+async def save_query_history(userid, query_history, duration):
+    """Persist planner bookkeeping; a failed write is logged and never fails the search it follows"""
+    try:
+        await firestore_service.set_query_history(userid, query_history, duration)
+    except Exception as e:
+        print(f"Error saving {duration} query history for {userid}: {e}")
+
+
+@router.get("/query_plan")
+async def get_query_plan(userid, duration: str = "month"):
+    """Show the Reddit searches the next /relevant_posts (month) or cron (day) run would make for a user"""
+    profile = await firestore_service.get_user_profile(user_id=userid)
+    primary = profile.primary_keywords
+    secondary = profile.secondary_keywords
+    query_history = profile.query_history.get(duration, {})
+    primary = primary.split(',') if isinstance(primary, str) else primary
+    secondary = secondary.split(',') if isinstance(secondary, str) else secondary
+    if primary == [""]:
+        primary = secondary
+    return plan_queries(primary, query_history).to_dict()
+
+
 @router.get("/get_subreddits")
 async def get_subreddits(userid):
-    posts = await firestore_service.get_user_posts(userid)  
-    print(posts)
-    subs = {post["subreddit"] for post in posts if "subreddit" in post} 
+    # The live collection, not the seen index: posts the user deleted must not steer the picks
+    subs, profile = await asyncio.gather(
+        firestore_service.get_post_subreddits(userid),
+        firestore_service.get_user_profile(user_id=userid),
+    )
+    print(subs)
     
-    company_description = await firestore_service.get_company_description(user_id=userid)
-    subreddit= filter_best_subreddits(subs, company_description)
+    subreddit= filter_best_subreddits(subs, profile.company_description)
+    print("llm cache:", llm_cache.stats())
     return subreddit
     
-async def cron_job_helper(userid):
-    primary = await firestore_service.get_primary_keywords(user_id=userid)
-    secondary = await firestore_service.get_secondary_keywords(user_id=userid)
-    excluded_subs = await firestore_service.get_excluded_reddits(user_id=userid)
-    reddit_posts = await firestore_service.get_user_posts(user_id=userid)
+async def cron_job_helper(userid, pending_writes=None):
+    """
+    Find a user's best new posts. They and the advanced high-water marks are added
+    to pending_writes if given, else stored right away; either way the marks are
+    only saved in the same batch as the posts they cover.
+    """
+    profile, seen = await asyncio.gather(
+        firestore_service.get_user_profile(user_id=userid),
+        firestore_service.get_seen_index(user_id=userid),
+    )
+    reddit_posts = seen.ids
+    primary = profile.primary_keywords
+    secondary = profile.secondary_keywords
+    excluded_subs = profile.excluded_subreddits
+    query_history = profile.query_history.get("day", {})
+    high_water_marks = profile.high_water_marks
+    company_description = profile.company_description
     if isinstance(primary, str):
         primary = primary.split(',')
     if isinstance(secondary, str):
@@ -102,21 +164,22 @@ async def cron_job_helper(userid):
         secondary_keywords=secondary,
     )
     try:
-        # Find relevant posts
-        results_df = find_relevant_posts(
+        # Find relevant posts; the search and scoring block, so they run off the event loop
+        results = await asyncio.to_thread(
+            find_relevant_posts,
             primary_keywords=keywords.primary_keywords,
             secondary_keywords=keywords.secondary_keywords,
             limit=keywords.limit,
             min_similarity=keywords.min_similarity,
             duration="day",
             excluded_subs=excluded_subs,
-            reddit_posts=reddit_posts
+            reddit_posts=reddit_posts,
+            query_history=query_history,
+            high_water_marks=high_water_marks,
+            semantic_query=company_description,
+            top_k=5
         )
-        if results_df.empty:
-            return []
-
-        # Convert DataFrame to list of dictionaries for response
-        results = results_df.astype(object).to_dict(orient="records")
+        await save_query_history(userid, query_history, "day")
 
         # id
         # subreddit
@@ -134,24 +197,186 @@ async def cron_job_helper(userid):
             llm_reply = "Add your reply here"
             # reddit_object = [obj["id"], obj["subreddit"], obj["title"], obj["body"], llm_reply]
 
-            reddit_object = [obj["id"], obj["subreddit"], obj["title"], obj["body"], llm_reply, obj["url"], obj["created_utc"]]
+            reddit_object = obj.to_reddit_object(llm_reply)
 
             reply_list.append(reddit_object)
-            await firestore_service.add_post(userid, reddit_object)
 
+        if pending_writes is not None:
+            pending_writes.add(userid, reply_list, high_water_marks)
+        else:
+            report = await firestore_service.add_posts([(userid, reddit_object) for reddit_object in reply_list],
+                                                       high_water_marks={userid: high_water_marks})
+            errors = [entry["error"] for entry in report if entry["error"]]
+            if errors:
+                raise RuntimeError(f"storing posts failed: {errors[0]}")
         return reply_list
         #return results
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error occurred: {str(e)}")
 
+async def stream_flush_helper(userid, candidates, keywords):
+    """Score posts routed to a user by the r/all stream and store the best ones; raises if storing fails"""
+    existing_post_ids = (await firestore_service.get_seen_index(user_id=userid)).ids
+    candidates = [post for post in candidates if post.id not in existing_post_ids]
+
+    results = score_posts(candidates, keywords.primary, keywords.secondary, top_k=5)
+    if results.empty:
+        return []
+    reply_list = []
+    for obj in results[:5]:
+        llm_reply = "Add your reply here"
+        reddit_object = obj.to_reddit_object(llm_reply)
+        reply_list.append(reddit_object)
+    report = await firestore_service.add_posts([(userid, reddit_object) for reddit_object in reply_list])
+    errors = [entry["error"] for entry in report if entry["error"]]
+    if errors:
+        raise RuntimeError(f"storing posts failed: {errors[0]}")
+    return reply_list
+
+async def run_cron_user(userid, pending_writes, semaphore):
+    """
+    Run cron_job_helper for one user under the concurrency cap and timeout, never raising.
+    Its Reddit requests wait for quota within the timeout instead of failing the user.
+    """
+    async with semaphore:
+        entry = {"user": userid, "status": "ok", "seconds": 0.0, "posts": 0, "api_calls": 0, "error": None}
+        start = time.perf_counter()
+        with count_requests() as counter, wait_for_quota(CRON_USER_TIMEOUT):
+            try:
+                reply_list = await asyncio.wait_for(cron_job_helper(userid, pending_writes), CRON_USER_TIMEOUT)
+                entry["posts"] = len(reply_list)
+            except asyncio.TimeoutError:
+                # The search thread cannot be cancelled; it finishes in the background and its results are dropped
+                entry["status"] = "timeout"
+                entry["error"] = f"timed out after {CRON_USER_TIMEOUT}s"
+            except Exception as e:
+                entry["status"] = "error"
+                entry["error"] = str(getattr(e, "detail", e))
+        entry["seconds"] = round(time.perf_counter() - start, 2)
+        entry["api_calls"] = counter.requests
+        return entry
+
+async def pregenerate_cron_replies(stored_writes):
+    """Draft replies for the posts a cron run stored, so users open them without waiting on Claude"""
+    stats = await pregenerate_replies(stored_writes, firestore_service)
+    print("reply pre-generation:", stats)
+    return stats
+
 # @router.get("/relevant_posts_weekly")
-async def get_relevant_posts_weekly_job():
+async def get_relevant_posts_weekly_job(pregen=REPLY_PREGEN):
     # Get keywords from Firestore
     print("cron jobbb")
+    started = time.perf_counter()
     active_users = await firestore_service.get_active_user_ids()
-    for user in active_users:
-        await cron_job_helper(user)
+    # Posts and marks from every user are written together in batched commits at the end
+    pending_writes = PendingWrites()
+    summary = []
+    semaphore = asyncio.Semaphore(CRON_CONCURRENCY)
+    try:
+        summary = await asyncio.gather(*(run_cron_user(user, pending_writes, semaphore) for user in active_users))
+    finally:
+        report = await firestore_service.add_posts(pending_writes.posts,
+                                                   high_water_marks=pending_writes.high_water_marks)
+        print(f"stored {len(pending_writes.posts)} posts in {len(report)} batches, "
+              f"{sum(entry['seconds'] for entry in report):.2f}s, "
+              f"{sum(1 for entry in report if entry['error'])} failed")
+    finish_cron_run(summary, started, CRON_CONCURRENCY)
+    if pregen:
+        # Only posts whose batch committed; drafting for the rest would be paid for and then fail to save
+        await pregenerate_cron_replies(pending_writes.for_users(stored_users(report)))
+    return summary
+
+
+def finish_cron_run(summary, started, concurrency):
+    """Persist shared state and print the per-user and total run summary"""
+    # Users with overlapping keywords share search results through the cache
+    print("search cache:", search_cache.stats())
+    print("promo rules:", rule_stats.snapshot())
+    # Persist the document frequencies this run added
+    corpus_idf.save()
+    print("corpus idf:", corpus_idf.stats())
+    print("semantic re-rank:", semantic_ranker.stats())
+    for entry in summary:
+        print("cron user:", entry)
+    failed = [entry for entry in summary if entry["status"] != "ok"]
+    print(f"cron run: {len(summary)} users, {len(failed)} failed, "
+          f"{sum(entry['posts'] for entry in summary)} posts, {sum(entry['api_calls'] for entry in summary)} API calls, "
+          f"{time.perf_counter() - started:.1f}s wall clock with concurrency {concurrency}")
+
+
+async def keep_lease(queue, run_id, userid, worker_id):
+    """Renew a claimed user's lease until cancelled"""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        if not await asyncio.to_thread(queue.heartbeat, run_id, userid, worker_id):
+            print(f"{worker_id} lost the lease on {userid}")
+            return
+
+
+async def cron_queue_worker(queue, run_id, worker_id, semaphore, stored_writes=None):
+    """
+    Claim users from the queue until the run is finished. A user is completed only
+    after its posts and advanced high-water marks are committed together, so a crash
+    or failed write leaves the marks where they were and the re-claimed user finds
+    the same posts again. Stored posts are appended to stored_writes for reply
+    pre-generation.
+    """
+    summary = []
+    while True:
+        userid = await asyncio.to_thread(queue.claim, run_id, worker_id)
+        if userid is None:
+            if await asyncio.to_thread(queue.unfinished, run_id) == 0:
+                return summary
+            # Other workers still hold leases; wait in case one of them dies and its lease expires
+            await asyncio.sleep(min(queue.lease_seconds / 4, 15))
+            continue
+        heartbeat = asyncio.create_task(keep_lease(queue, run_id, userid, worker_id))
+        pending_writes = PendingWrites()
+        try:
+            entry = await run_cron_user(userid, pending_writes, semaphore)
+            if entry["status"] == "ok" and not pending_writes.empty:
+                report = await firestore_service.add_posts(pending_writes.posts,
+                                                           high_water_marks=pending_writes.high_water_marks)
+                if userid not in stored_users(report):
+                    errors = [batch["error"] for batch in report if batch["error"]]
+                    entry["status"], entry["error"] = "error", f"storing posts failed: {errors[0]}"
+                elif stored_writes is not None:
+                    stored_writes.extend(pending_writes.posts)
+        finally:
+            heartbeat.cancel()
+        entry["worker"] = worker_id
+        await asyncio.to_thread(queue.complete, run_id, userid, worker_id, entry["seconds"], entry["error"])
+        summary.append(entry)
+
+
+async def run_cron_queue(run_id=None, workers=CRON_CONCURRENCY, worker_prefix=None, enqueue=True,
+                         pregen=REPLY_PREGEN):
+    """
+    Work-queue mode of the nightly job. Active users are enqueued under run_id
+    (default: today's UTC date) and `workers` workers claim them; any number of
+    processes sharing the queue file can run this at once. Re-running with the
+    same run_id resumes with the users that were not completed.
+    """
+    started = time.perf_counter()
+    run_id = run_id or datetime.utcnow().strftime("%Y-%m-%d")
+    worker_prefix = worker_prefix or f"{socket.gethostname()}-{os.getpid()}"
+    queue = WorkQueue()
+    if enqueue:
+        added = queue.enqueue(run_id, await firestore_service.get_active_user_ids())
+        print(f"cron run {run_id}: enqueued {added} new users, progress {queue.progress(run_id)}")
+    semaphore = asyncio.Semaphore(workers)
+    stored_writes = []
+    results = await asyncio.gather(*(
+        cron_queue_worker(queue, run_id, f"{worker_prefix}-{i}", semaphore, stored_writes) for i in range(workers)
+    ))
+    summary = [entry for worker_summary in results for entry in worker_summary]
+    finish_cron_run(summary, started, workers)
+    print(f"cron run {run_id}: progress {queue.progress(run_id)}")
+    if pregen:
+        # Only this process's posts; a crash before here leaves placeholders, which /reply still serves
+        await pregenerate_cron_replies(stored_writes)
+    return summary
         
         
 @router.get("/subreddit_posts")
@@ -159,13 +384,10 @@ async def get_relevant_sub_posts(subreddit):
     """Get posts for a subreddit"""
     try:
         # Find relevant posts
-        results_df = get_rising_posts(subreddit)
-        if results_df.empty:
+        results = get_rising_posts(subreddit)
+        if results.empty:
             return []
 
-        # Convert DataFrame to list of dictionaries for response
-        results = results_df.astype(object).to_dict(orient="records")
-
         # id
         # subreddit
         # title
@@ -182,12 +404,14 @@ async def get_relevant_sub_posts(subreddit):
         for i in range(iter):
             obj = results[i] 
             llm_reply = "Add your reply here"
-            reddit_object = [obj["id"], obj["subreddit"], obj["title"], obj["body"], llm_reply, obj["url"], obj["created_utc"]]
+            reddit_object = obj.to_reddit_object(llm_reply)
             reply_list.append(reddit_object)
 
         
         return reply_list
         #return results
 
+    except RateLimitExhausted as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error occurred: {str(e)}")
\ No newline at end of file
@@ -1,8 +1,14 @@
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from utils.finder import get_rising_posts, get_hot_posts, get_reply, get_keywords, get_reply_comm, get_reply_feedback, get_description
+from utils.finder import (
+    get_rising_posts, get_hot_posts, get_keywords, get_description,
+    build_reply_comm_prompt, build_reply_feedback_prompt,
+    generate_reply_async, get_reply_comm_async, get_reply_feedback_async, stream_reply,
+)
 
-from utils.rag_search import query_user_docs, format_company_docs
+from utils.reply_pregen import post_reply_prompt
 from typing import List
 from dotenv import load_dotenv
 import praw
@@ -59,22 +65,45 @@ async def reply_to_reddit_post(request: ReplyRequest, userid: str):
     
     
     
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def sse_reply(system_prompt, user_prompt):
+    """Server-sent events: one `data` event per text delta, then `done` with the full cleaned reply"""
+    parts = []
+    try:
+        async for text in stream_reply(system_prompt, user_prompt):
+            parts.append(text)
+            yield sse_event({"text": text})
+        yield sse_event({"reply": "".join(parts).strip('"')}, event="done")
+    except Exception as e:
+        yield sse_event({"error": f"Error getting summary: {str(e)}"}, event="error")
+
+
+def sse_response(events):
+    # no-cache and no proxy buffering, so each token reaches the browser as it is generated
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def reply_prompt(post: RedditPost, userid):
+    profile = await firestore_service.get_user_profile(user_id=userid)
+    return await post_reply_prompt(profile, userid, post.title, post.content)
+
+
 @router.post("/reply")
 async def get_reps(post: RedditPost, userid):
-    company_description = await firestore_service.get_company_description(user_id=userid) #1
-    company_name = await firestore_service.get_company_name(user_id=userid) #2
-    user_role = await firestore_service.get_user_role(user_id=userid) #3
-    sample_reply =  await firestore_service.get_sample_reply(user_id=userid)#4 
-    marketing_goals = await firestore_service.get_marketing_objectives(user_id=userid) #5
-    stri=query_user_docs(userid, post.content, 3)
-    print(stri)
-    company_docs = format_company_docs(stri)
-    print(company_docs)
-    
-    llm_reply = get_reply(f"title:{post.title} content: {post.content}", company_name, company_description, user_role, sample_reply, marketing_goals, company_docs=company_docs) # llm call 
+    llm_reply = await generate_reply_async(*await reply_prompt(post, userid)) # llm call 
     return llm_reply
 
 
+@router.post("/reply/stream")
+async def stream_reps(post: RedditPost, userid):
+    return sse_response(sse_reply(*await reply_prompt(post, userid)))
+
+
 
 @router.post("/regenerate-reply")
 async def get_reps_feedback(request: dict):
@@ -90,7 +119,7 @@ async def get_reps_feedback(request: dict):
     current_reply = post_data.get("suggested_reply", "")
     
     # Pass all context to the function
-    llm_reply = get_reply_feedback(
+    llm_reply = await get_reply_feedback_async(
         initial_reply=current_reply,
         feedback=feedback,
         post_title=post_title,
@@ -102,21 +131,43 @@ async def get_reps_feedback(request: dict):
     return llm_reply
 
 
+@router.post("/regenerate-reply/stream")
+async def stream_reps_feedback(request: dict):
+    post_data = request.get("post")
+    return sse_response(sse_reply(*build_reply_feedback_prompt(
+        initial_reply=post_data.get("suggested_reply", ""),
+        feedback=request.get("feedback"),
+        post_title=post_data.get("title", ""),
+        post_content=post_data.get("content", ""),
+        subreddit=post_data.get("subreddit", "")
+    )))
+
+
 
 
 @router.post("/community_reply")
 async def get_comm_reps(post: RedditPost, userid):
-    company_description = await firestore_service.get_company_description(user_id=userid) #1
-    company_name = await firestore_service.get_company_name(user_id=userid) #2
-    user_role = await firestore_service.get_user_role(user_id=userid) #3
-    sample_reply =  await firestore_service.get_sample_reply(user_id=userid)#4 
-    marketing_goals = await firestore_service.get_marketing_objectives(user_id=userid) #5
+    profile = await firestore_service.get_user_profile(user_id=userid)
+    company_description = profile.company_description
+    company_name = profile.company_name
+    user_role = profile.user_role
+    sample_reply = profile.sample_reply
+    marketing_goals = profile.marketing_goals
     
     
-    llm_reply = get_reply_comm(f"title:{post.title} content: {post.content}", company_name, company_description, user_role, sample_reply, marketing_goals) # llm call 
+    llm_reply = await get_reply_comm_async(f"title:{post.title} content: {post.content}", company_name, company_description, user_role, sample_reply, marketing_goals) # llm call 
     return llm_reply
 
 
+@router.post("/community_reply/stream")
+async def stream_comm_reps(post: RedditPost, userid):
+    profile = await firestore_service.get_user_profile(user_id=userid)
+    return sse_response(sse_reply(*build_reply_comm_prompt(
+        f"title:{post.title} content: {post.content}", profile.company_name, profile.company_description,
+        profile.user_role, profile.sample_reply, profile.marketing_goals
+    )))
+
+
 
 
 
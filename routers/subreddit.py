@@ -1,7 +1,9 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
 from utils.reddit import search_subreddits, rank_subreddits
+from utils.reddit_pool import RateLimitExhausted
 
 router = APIRouter()
 
@@ -12,10 +14,12 @@ class KeywordRequest(BaseModel):
 @router.post("/rank_subreddits/")
 async def get_ranked_subreddits(data: KeywordRequest):
     try:
-        # Search and rank subreddits
-        subreddits = search_subreddits(data.keywords, limit=50)
-        ranked_subreddits = rank_subreddits(subreddits)
+        # Search and rank subreddits; both block on Reddit, so they run off the event loop
+        subreddits = await asyncio.to_thread(search_subreddits, data.keywords, limit=50)
+        ranked_subreddits = await asyncio.to_thread(rank_subreddits, subreddits)
         return {"subreddits": ranked_subreddits}
+    except RateLimitExhausted as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,8 +1,22 @@
+import argparse
 import asyncio
-from routers.post import get_relevant_posts_weekly_job
+from routers.post import CRON_CONCURRENCY, get_relevant_posts_weekly_job, run_cron_queue
 
-async def main():
-    await get_relevant_posts_weekly_job()
+async def main(args):
+    if args.queue:
+        await run_cron_queue(run_id=args.run_id, workers=args.workers, enqueue=not args.no_enqueue,
+                             pregen=not args.no_pregen)
+    else:
+        await get_relevant_posts_weekly_job(pregen=not args.no_pregen)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Nightly relevant-posts sweep")
+    parser.add_argument("--queue", action="store_true",
+                        help="claim users from the lease queue (resumable, can run on several processes)")
+    parser.add_argument("--workers", type=int, default=CRON_CONCURRENCY, help="workers in this process")
+    parser.add_argument("--run-id", default=None, help="queue run to work on, default today's UTC date")
+    parser.add_argument("--no-enqueue", action="store_true",
+                        help="only work on users already enqueued by another process")
+    parser.add_argument("--no-pregen", action="store_true",
+                        help="store posts with the placeholder reply instead of drafting replies after the sweep")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import threading
+import time
+from routers.post import firestore_service, stream_flush_helper
+from utils.stream_ingest import INDEX_REFRESH_SECONDS, StreamIngestor, load_keyword_index
+
+# How often matched candidates are scored and stored
+FLUSH_INTERVAL_SECONDS = int(os.getenv("STREAM_FLUSH_INTERVAL", "300"))
+
+async def flush(ingestor):
+    for user in ingestor.pending_users():
+        candidates = ingestor.drain(user)
+        keywords = ingestor.index.users.get(user)
+        if not keywords:
+            continue
+        try:
+            await stream_flush_helper(user, candidates, keywords)
+        except Exception as e:
+            # Retried on the next flush; the seen index drops any that did get stored
+            print(f"Error flushing stream candidates for {user}, requeued {len(candidates)}: {e}")
+            ingestor.requeue(user, candidates)
+
+async def main():
+    ingestor = StreamIngestor(await load_keyword_index(firestore_service))
+    threading.Thread(target=ingestor.run, daemon=True).start()
+    last_refresh = time.monotonic()
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            await flush(ingestor)
+            if time.monotonic() - last_refresh >= INDEX_REFRESH_SECONDS:
+                ingestor.set_index(await load_keyword_index(firestore_service))
+                last_refresh = time.monotonic()
+            print("stream:", ingestor.stats())
+    finally:
+        ingestor.stop()
+        await flush(ingestor)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+load_dotenv()
+
+CORPUS_IDF_PATH = os.getenv("CORPUS_IDF_PATH", "corpus_idf.npz")
+# Hashed feature space; large enough that 1-3 gram collisions are rare
+CORPUS_IDF_FEATURES = int(os.getenv("CORPUS_IDF_FEATURES", str(2 ** 20)))
+# Document frequencies are written back to disk at most this often
+CORPUS_IDF_SAVE_INTERVAL = int(os.getenv("CORPUS_IDF_SAVE_INTERVAL", "300"))
+# Post ids remembered so a post fetched again is not counted twice
+CORPUS_IDF_SEEN_IDS = int(os.getenv("CORPUS_IDF_SEEN_IDS", "200000"))
+
+
+class CorpusIdf:
+    """
+    TF-IDF weighting whose document frequencies come from every post seen so far.
+
+    Features are hashed (same tokenization, stop words and 1-3 grams as the old
+    per-request TfidfVectorizer), so there is nothing to fit and `transform` is
+    safe to call from concurrent requests. New posts are folded into the
+    document frequencies under a lock, and the counts are persisted to disk so
+    the IDF survives restarts.
+    """
+
+    def __init__(self, path: str = CORPUS_IDF_PATH, n_features: int = CORPUS_IDF_FEATURES):
+        self.path = path
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            stop_words='english',
+            ngram_range=(1, 3),
+            analyzer='word',
+            token_pattern=r'(?u)\b\w+\b',
+            alternate_sign=False,
+            norm=None,
+        )
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self.n_docs = 0
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self._idf: Optional[np.ndarray] = None
+        self.load()
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                if data["doc_freq"].shape == self.doc_freq.shape:
+                    self.doc_freq = data["doc_freq"].astype(np.int64)
+                    self.n_docs = int(data["n_docs"])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading corpus IDF from {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            doc_freq, n_docs = self.doc_freq.copy(), self.n_docs
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            # Write next to the target and swap, so a crash never leaves a torn file
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez_compressed(tmp_path, doc_freq=doc_freq, n_docs=n_docs)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving corpus IDF to {self.path}: {e}")
+
+    def idf(self) -> np.ndarray:
+        """Smoothed IDF, computed the same way as TfidfVectorizer(smooth_idf=True)"""
+        with self._lock:
+            if self._idf is None:
+                self._idf = np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+            return self._idf
+
+    def update(self, ids: List[str], counts: csr_matrix):
+        """Count the rows of `counts` whose post id has not been seen before"""
+        with self._lock:
+            new_rows = []
+            for row, post_id in enumerate(ids):
+                if post_id in self._seen:
+                    self._seen.move_to_end(post_id)
+                    continue
+                self._seen[post_id] = None
+                new_rows.append(row)
+            while len(self._seen) > CORPUS_IDF_SEEN_IDS:
+                self._seen.popitem(last=False)
+            if not new_rows:
+                return
+            # Hashed rows have no duplicate indices, so each index is one document containing that feature
+            self.doc_freq += np.bincount(counts[new_rows].indices, minlength=self.doc_freq.shape[0])
+            self.n_docs += len(new_rows)
+            self._idf = None
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= CORPUS_IDF_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def transform(self, texts: List[str], ids: Optional[List[str]] = None) -> csr_matrix:
+        """
+        L2-normalized TF-IDF rows for the texts.
+
+        When `ids` is given, the texts are first added to the corpus, so posts
+        in this batch count towards the IDF they are scored with.
+        """
+        counts = self.hasher.transform(texts)
+        if ids is not None:
+            self.update(ids, counts)
+        weighted = counts.astype(np.float64)
+        weighted.data *= self.idf()[weighted.indices]
+        return normalize(weighted, norm='l2', copy=False)
+
+    def stats(self):
+        with self._lock:
+            return {"documents": self.n_docs, "features": int(np.count_nonzero(self.doc_freq)), "dirty": self._dirty}
+
+
+corpus_idf = CorpusIdf()
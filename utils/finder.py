@@ -1,62 +1,123 @@
 from fastapi import APIRouter
 import os
+import threading
 from dotenv import load_dotenv
-import praw
-from anthropic import Anthropic
+from utils.reddit_pool import reddit_pool
+from anthropic import Anthropic, AsyncAnthropic
 from datetime import datetime
-import pandas as pd
+from utils.post_batch import Post, PostBatch
+from utils.llm_cache import llm_cache
 load_dotenv()
 
-reddit = praw.Reddit(
-    client_id=os.getenv("CLIENT_ID"),
-    client_secret=os.getenv("CLIENT_SECRET"),
-    user_agent=os.getenv("USER_AGENT"),
-)
-
 
 client = Anthropic(
     api_key=os.getenv("CLAUDE_API_KEY")
 )
 
+# Used from async request handlers so generations don't block the event loop
+async_client = AsyncAnthropic(
+    api_key=os.getenv("CLAUDE_API_KEY")
+)
+
+REPLY_MODEL = "claude-3-5-sonnet-latest"
+
+# Running totals of prompt-cache usage across reply generations
+prompt_cache_stats = {"calls": 0, "input_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+                      "uncached_calls": 0}
+_prompt_cache_lock = threading.Lock()
+
+
+def cached_system(system_prompt, context):
+    """
+    System blocks with the per-company context marked as a cache breakpoint.
+
+    Everything up to and including `context` is identical for every post a
+    company replies to, so Anthropic serves it from the prompt cache after the
+    first call instead of re-processing it. Prefixes shorter than the model's
+    minimum cacheable length (1024 tokens for Sonnet) are silently not cached;
+    log_cache_usage reports those calls.
+    """
+    return [
+        {"type": "text", "text": system_prompt},
+        {"type": "text", "text": context, "cache_control": {"type": "ephemeral"}},
+    ]
+
+def log_cache_usage(label, usage, system_prompt=None):
+    """
+    Print and accumulate the cache hit/write token counts of one generation.
+
+    When `system_prompt` carries a cache breakpoint but nothing was written to
+    or read from the cache, the prefix was below the model's minimum and the
+    call is counted in prompt_cache_stats["uncached_calls"].
+    """
+    created = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    fresh = getattr(usage, "input_tokens", 0) or 0
+    uncached = isinstance(system_prompt, list) and not created and not read
+    with _prompt_cache_lock:
+        prompt_cache_stats["calls"] += 1
+        prompt_cache_stats["input_tokens"] += fresh
+        prompt_cache_stats["cache_creation_input_tokens"] += created
+        prompt_cache_stats["cache_read_input_tokens"] += read
+        prompt_cache_stats["uncached_calls"] += uncached
+    print(f"{label}: {fresh} uncached input tokens, {created} written to cache, {read} read from cache")
+    if uncached:
+        print(f"{label}: cached prefix is below the model's minimum cacheable length, nothing was cached")
+
+
+def cached_completion(model, system_prompt, user_prompt, max_tokens=1000):
+    """
+    Text of a single-turn completion, served from llm_cache when the same
+    model and prompts were sent before. Raises on API errors (nothing is cached).
+    """
+    def create():
+        message = client.messages.create(
+            model=model,
+            system=system_prompt,
+            max_tokens=max_tokens,
+            messages=[
+                {"role": "user", "content": user_prompt}
+            ]
+        )
+        return message.content[0].text
+    return llm_cache.get_or_create(model, system_prompt, user_prompt, max_tokens, create)
 
 
 def get_rising_posts(subreddit_name, limit=5):
-    subreddit = reddit.subreddit(subreddit_name)
-    rising_posts = subreddit.rising(limit=limit)
     posts = []
     
-    for post in rising_posts:
-        posts.append({
-            'id': post.id,
-            'title': post.title,
-            'body': post.selftext,
-            'url': f"https://reddit.com{post.permalink}",
-            'score': post.score,
-            'created_utc': datetime.fromtimestamp(post.created_utc),
-            'num_comments': post.num_comments,
-            'subreddit': post.subreddit.display_name
-        })
+    with reddit_pool.client() as reddit:
+        for post in reddit.subreddit(subreddit_name).rising(limit=limit):
+            posts.append(Post(
+                id=post.id,
+                title=post.title,
+                body=post.selftext,
+                url=f"https://reddit.com{post.permalink}",
+                score=post.score,
+                created_utc=datetime.fromtimestamp(post.created_utc),
+                num_comments=post.num_comments,
+                subreddit=post.subreddit.display_name,
+            ))
     
-    return pd.DataFrame(posts)
+    return PostBatch(posts)
 
 def get_hot_posts(subreddit_name, limit=5):
-    subreddit = reddit.subreddit(subreddit_name)
-    hot_posts = subreddit.hot(limit=limit)
     posts = []
     
-    for post in hot_posts:
-        posts.append({
-            'id': post.id,
-            'title': post.title,
-            'body': post.selftext,
-            'url': f"https://reddit.com{post.permalink}",
-            'score': post.score,
-            'created_utc': datetime.fromtimestamp(post.created_utc),
-            'num_comments': post.num_comments,
-            'subreddit': post.subreddit.display_name
-        })
+    with reddit_pool.client() as reddit:
+        for post in reddit.subreddit(subreddit_name).hot(limit=limit):
+            posts.append(Post(
+                id=post.id,
+                title=post.title,
+                body=post.selftext,
+                url=f"https://reddit.com{post.permalink}",
+                score=post.score,
+                created_utc=datetime.fromtimestamp(post.created_utc),
+                num_comments=post.num_comments,
+                subreddit=post.subreddit.display_name,
+            ))
     
-    return pd.DataFrame(posts)
+    return PostBatch(posts)
 
 def get_description(content):
     system_prompt = "Generate a company description from the given text. "
@@ -78,16 +139,7 @@ def get_description(content):
     """
     print(f"generating user description with the following prompt: {user_prompt}")
     try:
-        message = client.messages.create(
-            model="claude-3-5-haiku-20241022",
-            system=system_prompt,
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-
-        string = message.content[0].text
+        string = cached_completion("claude-3-5-haiku-20241022", system_prompt, user_prompt)
         cleaned_string = string.strip('"')
 
         return cleaned_string
@@ -107,22 +159,14 @@ def get_keywords(description):
     
     """
     try:
-        message = client.messages.create(
-            model="claude-3-5-haiku-20241022",
-            system=system_prompt,
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-
-        string = message.content[0].text
+        string = cached_completion("claude-3-5-haiku-20241022", system_prompt, user_prompt)
         cleaned_string = string.strip('"')
 
         return cleaned_string
     except Exception as e:
         return f"Error getting summary: {str(e)}"
-def get_reply_comm(text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives):
+def build_reply_comm_prompt(text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives):
+    """System and user prompt for a community reply, shared by the sync, async and streaming paths"""
     
     marketing_objectives = ""
     system_prompt = f"You are a brand strategy employee trained to craft personalized Reddit comment replies for {company_name} and look like an experienced professional in that field."
@@ -131,12 +175,8 @@ def get_reply_comm(text_to_reply, company_name, company_description, user_role,
     print(system_prompt)
     # if user_role:
         # system_prompt = f"You are an AI assistant trained to craft personalized Reddit comment replies for {company_name}. You can mention that you are a {user_role} at {company_name} but say it as a disclaimer in the end."
-    user_prompt = f"""Please generate a Reddit comment reply based on the following inputs:
-
-Text to reply to:
-{text_to_reply}
-
-<company_description>{company_description}</company_description>
+    # Everything but the post is fixed per user, so it goes in a cached prefix
+    context = f"""<company_description>{company_description}</company_description>
 
 <instructions>
 1. Craft a response that is helpful and adds value to the conversation.
@@ -149,42 +189,21 @@ Text to reply to:
 8. Keep the tone casual, how it is usually on reddit. Don't make it sound formal at all.
 9. If you're mentioning a different company, make sure to mention you're not affiliated with them.
 </instructions>
-
-
 """
+    if sample_replies:
+        context += f"\n<sample_responses>\n{sample_replies}\n</sample_responses>"
+        context += "\n10. Use the sample responses as a guide for style and content, but don't copy them directly."
 
+    user_prompt = f"""Please generate a Reddit comment reply based on the following inputs:
 
+Text to reply to:
+{text_to_reply}
 
-   
-    if sample_replies:
-        user_prompt += f"\n<sample_responses>\n{sample_replies}\n</sample_responses>"
-        user_prompt += "\n10. Use the sample responses as a guide for style and content, but don't copy them directly."
-
-    user_prompt += "\n\nPlease generate a Reddit comment reply based on these inputs."
-    try:
-        message = client.messages.create(
-            # model="claude-3-opus-20240229",
-            model="claude-3-5-sonnet-latest",
-            # model="claude-3-haiku-20240307",
-            system=system_prompt,
-            max_tokens=1000,
-            # messages=[
-            #     {
-            #         "role": "user",
-            #         "content": f"{prompt}\n\nText to reply to:\n{text_to_reply}"
-            #     }
-            # ]
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        string = message.content[0].text
-        cleaned_string = string.strip('"')
+Please generate a Reddit comment reply based on these inputs."""
+    return cached_system(system_prompt, context), user_prompt
 
-        return cleaned_string
-    except Exception as e:
-        return f"Error getting summary: {str(e)}"
-def get_reply_feedback(initial_reply, feedback, post_title, post_content, subreddit):
+def build_reply_feedback_prompt(initial_reply, feedback, post_title, post_content, subreddit):
+    """System and user prompt for regenerating a reply with feedback"""
     system_prompt = """You help generate authentic Reddit replies. This prompt you are regenerating a comment, incorporate it naturally while maintaining an authentic, conversational tone that fits the specific subreddit and post context."""
     
     user_prompt = f"""ORIGINAL POST CONTEXT:
@@ -214,24 +233,16 @@ def get_reply_feedback(initial_reply, feedback, post_title, post_content, subred
     9. Keep the response in one or two line unless mentioned by the user to make it longer.
     </instructions>
     """
-    print(user_prompt)
-    try:
-        message = client.messages.create(
-            model="claude-3-5-sonnet-latest",
-            system=system_prompt,
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+    return system_prompt, user_prompt
 
-        string = message.content[0].text
-        cleaned_string = string.strip('"')
-        return cleaned_string
-    except Exception as e:
-        return f"Error getting summary: {str(e)}"
+def build_reply_prompt(text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives, company_docs,
+                       pinned_docs=""):
+    """
+    System and user prompt for a reply that can mention the company.
 
-def get_reply(text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives, company_docs):
+    `pinned_docs` are the user's docs shared by every post and go in the cached
+    prefix; `company_docs` are retrieved for this post and go in the user prompt.
+    """
     
     marketing_objectives = ""
     system_prompt = f"You are an AI assistant trained to craft personalized Reddit comment replies for {company_name} and finding potential customers."
@@ -240,16 +251,8 @@ def get_reply(text_to_reply, company_name, company_description, user_role, sampl
     print(system_prompt)
     # if user_role:
         # system_prompt = f"You are an AI assistant trained to craft personalized Reddit comment replies for {company_name}. You can mention that you are a {user_role} at {company_name} but say it as a disclaimer in the end."
-    user_prompt = f"""Please generate a Reddit comment reply based on the following inputs:
-
-Text to reply to:
-{text_to_reply}
-
-<company_description>{company_description}</company_description>
-
-<company_docs> 
-{company_docs}
-<company_docs>
+    # Everything but the post and the docs retrieved for it is fixed per user, so it goes in a cached prefix
+    context = f"""<company_description>{company_description}</company_description>
 
 <instructions>
 1. Craft a response that is helpful and adds value to the conversation.
@@ -262,48 +265,79 @@ Text to reply to:
 8. Don't mention other companies outside of {company_name} if you're mentioning any company or software.
 9. Keep the tone casual, how it is usually on reddit. Don't make it sound formal at all.
 10. No emojis
-11. Be based heavily on the company docs above. If there's any way to pull a feature, use case, benefit, or insight from them, do it naturally.
+11. Be based heavily on the company docs. If there's any way to pull a feature, use case, benefit, or insight from them, do it naturally.
 </instructions>
-
-
 """
+    if marketing_objectives:
+        context += f"\n<marketing_objectives>{marketing_objectives}</marketing_objectives>"
+        context += "\n9. Subtly align the response with the marketing objectives."
 
+    if sample_replies:
+        context += f"\n<sample_responses>\n{sample_replies}\n</sample_responses>"
+        context += "\n10. Use the sample responses as a guide for style and content, but don't copy them directly."
 
+    if pinned_docs:
+        context += f"\n<company_docs>\n{pinned_docs}\n</company_docs>"
 
-    if marketing_objectives:
-        user_prompt += f"\n<marketing_objectives>{marketing_objectives}</marketing_objectives>"
-        user_prompt += "\n9. Subtly align the response with the marketing objectives."
+    docs_block = f"""
+<company_docs> 
+{company_docs}
+<company_docs>
+""" if company_docs or not pinned_docs else ""
 
-    if sample_replies:
-        user_prompt += f"\n<sample_responses>\n{sample_replies}\n</sample_responses>"
-        user_prompt += "\n10. Use the sample responses as a guide for style and content, but don't copy them directly."
+    user_prompt = f"""Please generate a Reddit comment reply based on the following inputs:
 
-    user_prompt += "\n\nPlease generate a Reddit comment reply based on these inputs."
+Text to reply to:
+{text_to_reply}
+{docs_block}
+Please generate a Reddit comment reply based on these inputs."""
+    return cached_system(system_prompt, context), user_prompt
+
+async def generate_reply_async(system_prompt, user_prompt, model=REPLY_MODEL):
+    """Reply text for a (system, user) prompt pair; API errors come back as "Error getting summary: ..." text"""
     try:
-        message = client.messages.create(
-            # model="claude-3-opus-20240229",
-            model="claude-3-5-sonnet-latest",
-            # model="claude-3-haiku-20240307",
+        message = await async_client.beta.prompt_caching.messages.create(
+            model=model,
             system=system_prompt,
             max_tokens=1000,
-            # messages=[
-            #     {
-            #         "role": "user",
-            #         "content": f"{prompt}\n\nText to reply to:\n{text_to_reply}"
-            #     }
-            # ]
             messages=[
                 {"role": "user", "content": user_prompt}
             ]
         )
-        print(user_prompt)
-        string = message.content[0].text
-        cleaned_string = string.strip('"')
-
-        return cleaned_string
+        log_cache_usage("reply", message.usage, system_prompt)
+        return message.content[0].text.strip('"')
     except Exception as e:
         return f"Error getting summary: {str(e)}"
-    
+
+async def stream_reply(system_prompt, user_prompt, model=REPLY_MODEL):
+    """
+    Yield the reply text as Claude generates it.
+
+    The caller gets the first tokens as soon as they are produced instead of
+    waiting for the whole message.
+    """
+    async with async_client.beta.prompt_caching.messages.stream(
+        model=model,
+        system=system_prompt,
+        max_tokens=1000,
+        messages=[
+            {"role": "user", "content": user_prompt}
+        ]
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+        log_cache_usage("streamed reply", (await stream.get_final_message()).usage, system_prompt)
+
+async def get_reply_comm_async(text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives):
+    return await generate_reply_async(*build_reply_comm_prompt(
+        text_to_reply, company_name, company_description, user_role, sample_replies, marketing_objectives
+    ))
+
+async def get_reply_feedback_async(initial_reply, feedback, post_title, post_content, subreddit):
+    return await generate_reply_async(*build_reply_feedback_prompt(
+        initial_reply, feedback, post_title, post_content, subreddit
+    ))
+
 
 ########################################################################
 
@@ -344,16 +378,8 @@ def filter_best_subreddits(subreddit_list, company_description, num_subreddits=1
 """
     
     try:
-        message = client.messages.create(
-            model="claude-3-5-sonnet-latest",
-            system=system_prompt,
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
         print(user_prompt)
-        response = message.content[0].text.strip()
+        response = cached_completion("claude-3-5-sonnet-latest", system_prompt, user_prompt).strip()
         return response
             
     except Exception as e:
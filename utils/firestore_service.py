@@ -1,14 +1,25 @@
 from fastapi import FastAPI, HTTPException
-from firebase_admin import credentials, firestore, initialize_app
-from typing import List, Optional
+from firebase_admin import credentials, firestore, firestore_async, initialize_app
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from datetime import datetime
 import firebase_admin
+import asyncio
+import zlib
 import os 
+import time
 from dotenv import load_dotenv
 from google.oauth2 import service_account
 
 load_dotenv()
 
+# Firestore rejects WriteBatch commits of more than 500 writes
+WRITE_BATCH_SIZE = min(int(os.getenv("FIRESTORE_WRITE_BATCH_SIZE", "500")), 500)
+WRITE_BATCH_RETRIES = int(os.getenv("FIRESTORE_WRITE_RETRIES", "3"))
+WRITE_RETRY_BACKOFF = float(os.getenv("FIRESTORE_WRITE_BACKOFF", "0.5"))
+# Seen-post ids are spread over this many documents per user to stay far below the 1 MiB document limit
+SEEN_INDEX_SHARDS = int(os.getenv("SEEN_INDEX_SHARDS", "4"))
+
 
 # Initialize Firebase Admin SDK
 service_account_key_json = {
@@ -35,16 +46,160 @@ firebase_admin.initialize_app(cred, {'projectId': os.getenv("project_id")})
 # Initialize Firestore client
 db = firestore.client()
 
+@dataclass
+class UserProfile:
+    """Everything the routers read about a user, loaded in one round trip by get_user_profile"""
+    user_id: str
+    # onboarding/{uid}
+    keywords: Any = field(default_factory=list)
+    primary_keywords: Any = field(default_factory=list)
+    secondary_keywords: Any = field(default_factory=list)
+    company_name: Optional[str] = None
+    company_description: Optional[str] = None
+    # ai-training/{uid}
+    user_role: Optional[str] = None
+    sample_reply: Optional[str] = None
+    marketing_goals: Optional[str] = None
+    # excluded-subreddits/{uid}
+    excluded_subreddits: Any = field(default_factory=list)
+    # query-history/{uid}, keyed by search duration then query; and ingest-state/{uid}
+    query_history: Dict[str, Dict[str, Dict]] = field(default_factory=dict)
+    high_water_marks: Dict[str, Dict] = field(default_factory=dict)
+
+
+def parse_query_history(data: Dict) -> Dict[str, Dict[str, Dict]]:
+    """
+    Per-duration query histories from a query-history document. Each duration is
+    its own `queries_<duration>` field, so the daily cron's low yields never prune
+    the month search of /relevant_posts.
+    """
+    histories: Dict[str, Dict[str, Dict]] = {}
+    # The unsplit `queries` field predates per-duration histories; it was written mostly by the daily cron
+    fields = [('queries', 'day')] + [(key, key[len('queries_'):]) for key in data if key.startswith('queries_')]
+    for key, duration in fields:
+        # Stored as a list because query strings are not safe Firestore field names
+        entries = data.get(key, [])
+        if entries:
+            histories[duration] = {entry["query"]: {k: v for k, v in entry.items() if k != "query"} for entry in entries}
+    return histories
+
+
+def parse_high_water_marks(data: Dict) -> Dict[str, Dict]:
+    entries = data.get('marks', [])
+    return {entry["query"]: {"created_utc": entry["created_utc"], "fullname": entry["fullname"]} for entry in entries}
+
+
+@dataclass
+class SeenIndex:
+    """
+    Ids and subreddits of every post ever stored for a user, read from the compact
+    seen-posts index. Deleted posts stay in it (so they are not fetched again);
+    use get_post_subreddits for the user's current posts.
+    """
+    ids: Set[str] = field(default_factory=set)
+    subreddits: Set[str] = field(default_factory=set)
+
+
+def seen_shard(post_id: str) -> int:
+    return zlib.crc32(post_id.encode()) % SEEN_INDEX_SHARDS
+
+
+@dataclass
+class PendingWrites:
+    """Posts and advanced high-water marks found by the cron, stored together by add_posts"""
+    posts: List[Tuple[str, List]] = field(default_factory=list)
+    high_water_marks: Dict[str, Dict[str, Dict]] = field(default_factory=dict)
+
+    def add(self, user_id: str, reddit_objects: List[List], marks: Dict[str, Dict]):
+        # No await in between, so a user cancelled by its timeout contributes both or neither
+        self.posts.extend((user_id, reddit_object) for reddit_object in reddit_objects)
+        self.high_water_marks[user_id] = marks
+
+    def for_users(self, user_ids: Set[str]) -> List[Tuple[str, List]]:
+        return [(user_id, reddit_object) for user_id, reddit_object in self.posts if user_id in user_ids]
+
+    @property
+    def empty(self) -> bool:
+        return not self.posts and not self.high_water_marks
+
+
+def stored_users(report: List[Dict]) -> Set[str]:
+    """Users all of whose writes were committed, from an add_posts report"""
+    users = {user for entry in report for user in entry["users"]}
+    return users - {user for entry in report if entry["error"] for user in entry["users"]}
+
+
+def post_document(reddit_object: List, created_at: Optional[datetime] = None) -> Dict:
+    """Firestore document for a positional reddit_object (see Post.to_reddit_object)"""
+    date_created = reddit_object[6]
+    if isinstance(date_created, datetime):
+        date_created = date_created.isoformat() + "Z"
+    elif isinstance(date_created, (int, float)):
+        date_created = datetime.utcfromtimestamp(date_created).isoformat() + "Z"
+    else:
+        raise TypeError(f"Unexpected type for date_created: {type(date_created)}")
+    return {
+        "id": reddit_object[0],
+        "subreddit": reddit_object[1],
+        "title": reddit_object[2],
+        "content": reddit_object[3],
+        "suggestedReply": reddit_object[4],
+        "url": reddit_object[5],
+        "date_created": date_created,
+        "createdAt": (created_at or datetime.now()).isoformat() + "Z",
+    }
+
+
 class FirestoreService:
     def __init__(self):
-        self.db = firestore.client()
+        # AsyncClient: every round trip is awaited on the event loop instead of blocking it
+        self.db = firestore_async.client()
+
+    async def get_user_profile(self, user_id: str) -> UserProfile:
+        """
+        Load a user's onboarding, ai-training, excluded-subreddits, query-history and
+        ingest-state documents with a single get_all instead of one get() per field
+        """
+        try:
+            refs = {
+                name: self.db.collection(name).document(user_id)
+                for name in ('onboarding', 'ai-training', 'excluded-subreddits', 'query-history', 'ingest-state')
+            }
+            # get_all does not preserve order, so match snapshots back by path
+            by_path = {doc.reference.path: doc async for doc in self.db.get_all(list(refs.values()))}
+            docs = {}
+            for name, ref in refs.items():
+                doc = by_path.get(ref.path)
+                docs[name] = doc.to_dict() if doc is not None and doc.exists else None
+
+            profile = UserProfile(user_id=user_id)
+            onboarding = docs['onboarding']
+            if onboarding is not None:
+                profile.keywords = onboarding.get('keywords', [])
+                profile.primary_keywords = onboarding.get('primaryKeywords', [])
+                profile.secondary_keywords = onboarding.get('secondaryKeywords', [])
+                profile.company_name = onboarding.get('companyName', None)
+                profile.company_description = onboarding.get('companyDescription', None)
+            training = docs['ai-training']
+            if training is not None:
+                profile.user_role = training.get('postAs', None)
+                profile.sample_reply = training.get('sampleReply', None)
+                profile.marketing_goals = training.get('marketingGoals', None)
+            if docs['excluded-subreddits'] is not None:
+                profile.excluded_subreddits = docs['excluded-subreddits'].get('subreddits', '')
+            if docs['query-history'] is not None:
+                profile.query_history = parse_query_history(docs['query-history'])
+            if docs['ingest-state'] is not None:
+                profile.high_water_marks = parse_high_water_marks(docs['ingest-state'])
+            return profile
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching user profile: {str(e)}")
 
     async def get_active_user_ids(self) -> List[str]:
         """Retrieve all user IDs where accountStatus is 'active' from the 'account-details' collection"""
         try:
             users_ref = self.db.collection("account-details").where("accountStatus", "==", "active")
-            docs = users_ref.stream()
-            user_ids = [doc.get("userId") for doc in docs if doc.get("userId")]
+            user_ids = [doc.get("userId") async for doc in users_ref.stream() if doc.get("userId")]
             return user_ids
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error fetching active user IDs: {str(e)}")
@@ -52,7 +207,7 @@ class FirestoreService:
         """Get keywords for a specific user"""
         try:
             doc_ref = self.db.collection('onboarding').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return []
@@ -65,7 +220,7 @@ class FirestoreService:
         """Get keywords for a specific user"""
         try:
             doc_ref = self.db.collection('onboarding').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return []
@@ -78,7 +233,7 @@ class FirestoreService:
         """Get keywords for a specific user"""
         try:
             doc_ref = self.db.collection('onboarding').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return []
@@ -91,7 +246,7 @@ class FirestoreService:
         """Get company name for a specific user"""
         try:
             doc_ref = self.db.collection('onboarding').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -104,7 +259,7 @@ class FirestoreService:
         """Get company description for a specific user"""
         try:
             doc_ref = self.db.collection('ai-training').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -117,7 +272,7 @@ class FirestoreService:
         """Get company description for a specific user"""
         try:
             doc_ref = self.db.collection('ai-training').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -130,7 +285,7 @@ class FirestoreService:
         """Get company description for a specific user"""
         try:
             doc_ref = self.db.collection('ai-training').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -143,7 +298,7 @@ class FirestoreService:
         """Get pain points for a specific user"""
         try:
             doc_ref = self.db.collection('ai-training').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -156,7 +311,7 @@ class FirestoreService:
         """Get company description for a specific user"""
         try:
             doc_ref = self.db.collection('onboarding').document(user_id)
-            doc = doc_ref.get()
+            doc = await doc_ref.get()
             
             if not doc.exists:
                 return None
@@ -169,48 +324,218 @@ class FirestoreService:
         """Add a post to the 'reddit-posts' collection for a specific user"""
         try:
             # Extract post details from the reddit_object
-            post_data = {
-                "id": reddit_object[0],
-                "subreddit": reddit_object[1],
-                "title": reddit_object[2],
-                "content": reddit_object[3],
-                "suggestedReply": reddit_object[4],
-                "url": reddit_object[5],
-                "date_created": reddit_object[6],
-                "createdAt": datetime.now(),
-            }
-            if isinstance(reddit_object[6], datetime):
-                post_data["date_created"] = reddit_object[6].isoformat() + "Z"
-            elif isinstance(reddit_object[6], int) or isinstance(reddit_object[6], float):
-                post_data["date_created"] = datetime.utcfromtimestamp(reddit_object[6]).isoformat() + "Z"
-            else:
-                raise TypeError(f"Unexpected type for date_created: {type(reddit_object[6])}")
-            if isinstance(post_data["createdAt"], datetime):
-                post_data["createdAt"] = post_data["createdAt"].isoformat() + "Z"
-            elif isinstance(post_data["createdAt"], (int, float)):
-                post_data["createdAt"] = datetime.utcfromtimestamp(post_data["createdAt"]).isoformat() + "Z"
-            else:
-                raise TypeError(f"Unexpected type for createdAt: {type(post_data['createdAt'])}")
+            post_data = post_document(reddit_object)
 
-            
             # Reference to the "posts" subcollection for the user
             posts_collection_ref = self.db.collection("reddit-posts").document(user_id).collection("posts")
             
             # Add the post to Firestore
             post_doc_ref = posts_collection_ref.document(post_data["id"])
-            post_doc_ref.set(post_data)
+            batch = self.db.batch()
+            batch.set(post_doc_ref, post_data)
+            for ref, data in self._seen_index_writes(user_id, [reddit_object]):
+                batch.set(ref, data, merge=True)
+            await batch.commit()
 
             return f"Post {post_data['id']} added successfully!"
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error adding post: {str(e)}")
         
+    async def add_posts(self, posts: List[Tuple[str, List]], batch_size: int = WRITE_BATCH_SIZE,
+                        retries: int = WRITE_BATCH_RETRIES,
+                        high_water_marks: Optional[Dict[str, Dict[str, Dict]]] = None) -> List[Dict]:
+        """
+        Write many posts, possibly for many users, in WriteBatch commits of at most batch_size.
+
+        A user's posts, seen-index entries and high-water marks go in the same batch
+        (unless they alone exceed batch_size), so marks are never saved without the
+        posts they cover. Each batch is committed atomically and retried with
+        exponential backoff; a batch that still fails is reported and skipped so the
+        others are written.
+
+        Args:
+            posts: (user_id, reddit_object) pairs
+            batch_size: Documents per commit; Firestore allows at most 500
+            retries: Extra attempts per batch after the first failure
+            high_water_marks: Advanced marks per user_id, saved together with that user's posts
+
+        Returns:
+            One entry per batch with its size, users, attempts, latency and error (if any);
+            see stored_users
+        """
+        created_at = datetime.now()
+        by_user: Dict[str, List] = {}
+        for user_id, reddit_object in posts:
+            by_user.setdefault(user_id, []).append(reddit_object)
+        groups = []
+        for user_id in dict.fromkeys([*by_user, *(high_water_marks or {})]):
+            reddit_objects = by_user.get(user_id, [])
+            writes = [
+                (self.db.collection("reddit-posts").document(user_id).collection("posts").document(str(reddit_object[0])),
+                 post_document(reddit_object, created_at), "set")
+                for reddit_object in reddit_objects
+            ]
+            writes.extend((ref, data, "merge") for ref, data in self._seen_index_writes(user_id, reddit_objects))
+            if high_water_marks and user_id in high_water_marks:
+                writes.append((*self._high_water_marks_write(user_id, high_water_marks[user_id]), "set"))
+            groups.append((user_id, writes))
+        return await self._commit_in_batches(groups, batch_size, retries)
+
+    async def set_suggested_replies(self, replies: List[Tuple[str, str, str]], batch_size: int = WRITE_BATCH_SIZE,
+                                    retries: int = WRITE_BATCH_RETRIES) -> List[Dict]:
+        """
+        Fill in drafted replies on stored posts, one WriteBatch per user.
+
+        Updates (not sets), so a post that was never stored or was deleted since is
+        not recreated with only a suggestedReply. Its batch fails and is reported,
+        and because batches are per user only that user's replies are lost.
+
+        Args:
+            replies: (user_id, post_id, reply) triples
+
+        Returns:
+            One entry per batch with its size, attempts, latency and error (if any)
+        """
+        by_user: Dict[str, List] = {}
+        for user_id, post_id, reply in replies:
+            by_user.setdefault(user_id, []).append(
+                (self.db.collection("reddit-posts").document(user_id).collection("posts").document(str(post_id)),
+                 {"suggestedReply": reply}, "update"))
+        return await self._commit_in_batches(list(by_user.items()), batch_size, retries, pack=False)
+
+    async def _commit_in_batches(self, groups: List[Tuple[str, List[Tuple[Any, Dict, str]]]], batch_size: int,
+                                 retries: int, pack: bool = True) -> List[Dict]:
+        """
+        Commit per-user groups of (ref, data, mode) writes, mode being "set", "merge" or
+        "update". Groups are packed into batches (one batch per group if not `pack`)
+        without being split unless one alone exceeds batch_size; each batch is retried
+        with backoff.
+        """
+        batches: List[Tuple[Set[str], List]] = []
+        for user_id, writes in groups:
+            for start in range(0, len(writes), batch_size):
+                chunk = writes[start:start + batch_size]
+                if not batches or not pack or len(batches[-1][1]) + len(chunk) > batch_size:
+                    batches.append((set(), []))
+                batches[-1][0].add(user_id)
+                batches[-1][1].extend(chunk)
+        report = []
+        for number, (users, chunk) in enumerate(batches, 1):
+            entry = {"size": len(chunk), "users": sorted(users), "attempts": 0, "seconds": 0.0, "error": None}
+            began = time.perf_counter()
+            for attempt in range(retries + 1):
+                entry["attempts"] = attempt + 1
+                batch = self.db.batch()
+                for ref, data, mode in chunk:
+                    if mode == "update":
+                        batch.update(ref, data)
+                    else:
+                        batch.set(ref, data, merge=mode == "merge")
+                try:
+                    await batch.commit()
+                    entry["error"] = None
+                    break
+                except Exception as e:
+                    entry["error"] = str(e)
+                    if attempt < retries:
+                        await asyncio.sleep(WRITE_RETRY_BACKOFF * 2 ** attempt)
+            entry["seconds"] = time.perf_counter() - began
+            print(f"Firestore batch {number}: {len(chunk)} writes for {len(users)} users, "
+                  f"{entry['attempts']} attempts, {entry['seconds']:.2f}s, error {entry['error']}")
+            report.append(entry)
+        return report
+
+    def _seen_shard_ref(self, user_id: str, shard: int):
+        return self.db.collection("seen-posts").document(user_id).collection("shards").document(str(shard))
+
+    def _seen_index_writes(self, user_id: str, reddit_objects: List[List]) -> List[Tuple[Any, Dict]]:
+        """Merge writes adding the posts' ids and subreddits to their seen-posts shards"""
+        shards: Dict[int, Tuple[List, List]] = {}
+        for reddit_object in reddit_objects:
+            ids, subreddits = shards.setdefault(seen_shard(str(reddit_object[0])), ([], []))
+            ids.append(str(reddit_object[0]))
+            if reddit_object[1]:
+                subreddits.append(reddit_object[1])
+        return [
+            (self._seen_shard_ref(user_id, shard),
+             {"ids": firestore.ArrayUnion(ids), "subreddits": firestore.ArrayUnion(subreddits)})
+            for shard, (ids, subreddits) in shards.items()
+        ]
+
+    async def get_seen_index(self, user_id: str) -> SeenIndex:
+        """
+        Ids and subreddits of the user's stored posts from the seen-posts shards (one get_all).
+
+        Users whose index was never completed (posts stored before it existed) get it
+        rebuilt once from an id/subreddit projection of their posts subcollection.
+        """
+        try:
+            refs = [self._seen_shard_ref(user_id, shard) for shard in range(SEEN_INDEX_SHARDS)]
+            index = SeenIndex()
+            complete = False
+            async for doc in self.db.get_all(refs):
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                index.ids.update(data.get("ids", []))
+                index.subreddits.update(data.get("subreddits", []))
+                complete = complete or data.get("complete", False)
+            if not complete:
+                return await self.rebuild_seen_index(user_id)
+            return index
+        except Exception as e:
+            print(f"Error fetching seen-post index: {e}")
+            return await self.rebuild_seen_index(user_id, persist=False)
+
+    async def rebuild_seen_index(self, user_id: str, persist: bool = True) -> SeenIndex:
+        """Build the seen-post index from an id/subreddit projection instead of full post documents"""
+        posts_collection_ref = self.db.collection("reddit-posts").document(user_id).collection("posts")
+        index = SeenIndex()
+        objects = []
+        try:
+            async for doc in posts_collection_ref.select(["id", "subreddit"]).stream():
+                data = doc.to_dict()
+                post_id = str(data.get("id") or doc.id)
+                index.ids.add(post_id)
+                if data.get("subreddit"):
+                    index.subreddits.add(data["subreddit"])
+                objects.append([post_id, data.get("subreddit", "")])
+        except Exception as e:
+            print(f"Error rebuilding seen-post index: {e}")
+            return index
+        if persist:
+            # Only shard 0 carries the flag; get_seen_index treats the index as complete if any shard does
+            writes = self._seen_index_writes(user_id, objects)
+            writes.append((self._seen_shard_ref(user_id, 0), {"complete": True}))
+            batch = self.db.batch()
+            for ref, data in writes:
+                batch.set(ref, data, merge=True)
+            await batch.commit()
+        return index
+
+    async def get_post_subreddits(self, user_id: str) -> Set[str]:
+        """
+        Subreddits of the user's current posts, from a subreddit-only projection of the
+        live posts collection. Unlike the seen index this drops posts the user deleted.
+        """
+        posts_collection_ref = self.db.collection("reddit-posts").document(user_id).collection("posts")
+        subreddits = set()
+        try:
+            async for doc in posts_collection_ref.select(["subreddit"]).stream():
+                subreddit = doc.to_dict().get("subreddit")
+                if subreddit:
+                    subreddits.add(subreddit)
+        except Exception as e:
+            print(f"Error fetching post subreddits: {e}")
+        return subreddits
+
     async def add_reply_to_user(self, user_id: str, reply_id: str):
         user_doc = self.db.collection('track-replies').document(user_id)
-        user_doc.set({'replies': firestore.ArrayUnion([reply_id])}, merge=True)
+        await user_doc.set({'replies': firestore.ArrayUnion([reply_id])}, merge=True)
 
     async def get_replies_for_user(self, user_id: str) -> List[str]:
         user_doc = self.db.collection('track-replies').document(user_id)
-        doc = user_doc.get()
+        doc = await user_doc.get()
         if doc.exists:
             return doc.to_dict().get('replies', [])
         return []
@@ -219,16 +544,29 @@ class FirestoreService:
         posts_collection_ref = self.db.collection("reddit-posts").document(user_id).collection("posts")
         
         try:
-            posts = posts_collection_ref.get()
+            posts = await posts_collection_ref.get()
             post_list = [post.to_dict() for post in posts]
             return post_list
         except Exception as e:
             print(f"Error fetching posts: {e}")
             return []
 
+    async def set_query_history(self, user_id: str, history: Dict[str, Dict], duration: str):
+        """Save one duration's history; other durations in the document are left untouched"""
+        entries = [{"query": query, **stats} for query, stats in history.items()]
+        data = {f'queries_{duration}': entries}
+        if duration == 'day':
+            # Superseded by queries_day
+            data['queries'] = firestore.DELETE_FIELD
+        await self.db.collection('query-history').document(user_id).set(data, merge=True)
+
+    def _high_water_marks_write(self, user_id: str, marks: Dict[str, Dict]) -> Tuple[Any, Dict]:
+        entries = [{"query": query, **mark} for query, mark in marks.items()]
+        return self.db.collection('ingest-state').document(user_id), {'marks': entries}
+
     async def get_excluded_reddits(self, user_id: str) -> List[str]:
         user_doc = self.db.collection('excluded-subreddits').document(user_id)
-        doc = user_doc.get()
+        doc = await user_doc.get()
         if doc.exists:
             return doc.to_dict().get('subreddits', '')
         return []
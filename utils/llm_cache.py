@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+# Keywords, descriptions and subreddit picks for unchanged inputs are reused for a week
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Least recently used entries beyond this are evicted
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_responses_accessed ON llm_responses (accessed_at);
+"""
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+    """Content address of a completion request: identical inputs give the same key"""
+    payload = json.dumps([model, system_prompt, user_prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Disk-backed cache of Claude completions, keyed by a hash of the model and prompts.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted past `max_entries`. The SQLite file survives restarts, so onboarding
+    retries and repeated /get_subreddits calls over the same inputs return the
+    stored text without a network call.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            # e.g. a read-only deployment filesystem: every call goes to the API as before
+            print(f"LLM cache disabled, cannot open {path}: {e}")
+            self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        if self._conn is None:
+            return None
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response FROM llm_responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                # e.g. "database is locked": treat as a miss so the caller still reaches the API
+                self._conn.rollback()
+                print(f"Error reading LLM cache: {e}")
+                return None
+        return None if row is None else row[0]
+
+    def set(self, key: str, model: str, response: str):
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, response, now, now),
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # The response was already produced; failing to cache it must not fail the caller
+                self._conn.rollback()
+                print(f"Error caching LLM response: {e}")
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        removed = self._conn.execute("DELETE FROM llm_responses WHERE created_at <= ?", (now - self.ttl,)).rowcount
+        removed += self._conn.execute(
+            """DELETE FROM llm_responses WHERE key IN (
+                   SELECT key FROM llm_responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += removed
+
+    def get_or_create(self, model: str, system_prompt: str, user_prompt: str, max_tokens: int,
+                      create: Callable[[], str]) -> str:
+        """
+        Return the cached response for these inputs, or call `create` and store what it returns.
+
+        `create` should raise on failure; exceptions propagate and nothing is cached.
+        """
+        key = cache_key(model, system_prompt, user_prompt, max_tokens)
+        response = self.get(key)
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+            return response
+        with self._lock:
+            self.misses += 1
+        response = create()
+        self.set(key, model, response)
+        return response
+
+    def clear(self):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_responses")
+            self._conn.commit()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = 0 if self._conn is None else self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": size}
+
+
+llm_cache = LLMCache()
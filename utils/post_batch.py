@@ -0,0 +1,110 @@
+import heapq
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+
+class Post:
+    """
+    One Reddit post as it flows from fetch through scoring to the response.
+
+    Uses __slots__ instead of a dict per post; the score fields are filled in
+    by score_posts (and semantic_score by the optional semantic re-rank).
+    """
+
+    __slots__ = (
+        "id", "title", "body", "url", "score", "created_utc", "num_comments", "subreddit", "author",
+        "similarity_score", "primary_score", "secondary_score", "semantic_score",
+    )
+
+    def __init__(self, id: str, title: str, body: str, url: str, score: int, created_utc: datetime,
+                 num_comments: int, subreddit: str, author: Optional[str] = None):
+        self.id = id
+        self.title = title
+        self.body = body
+        self.url = url
+        self.score = score
+        self.created_utc = created_utc
+        self.num_comments = num_comments
+        self.subreddit = subreddit
+        self.author = author
+        self.similarity_score = 0.0
+        self.primary_score = 0.0
+        self.secondary_score = 0.0
+        self.semantic_score = 0.0
+
+    @property
+    def text(self) -> str:
+        # Title and body combined for text analysis
+        return f"{self.title} {self.body}"
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_reddit_object(self, llm_reply: str = "Add your reply here") -> list:
+        """Positional list the frontend and FirestoreService.add_post expect"""
+        return [self.id, self.subreddit, self.title, self.body, llm_reply, self.url, self.created_utc]
+
+
+def rank_key(post: Post):
+    return (post.similarity_score, post.score)
+
+
+class PostBatch:
+    """Ordered collection of Post records with column access for vectorized scoring"""
+
+    __slots__ = ("posts",)
+
+    def __init__(self, posts: Optional[Iterable[Post]] = None):
+        self.posts: List[Post] = list(posts) if posts is not None else []
+
+    def __len__(self) -> int:
+        return len(self.posts)
+
+    def __iter__(self) -> Iterator[Post]:
+        return iter(self.posts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PostBatch(self.posts[index])
+        return self.posts[index]
+
+    @property
+    def empty(self) -> bool:
+        return not self.posts
+
+    def texts(self) -> List[str]:
+        return [post.text for post in self.posts]
+
+    def column(self, name: str) -> np.ndarray:
+        return np.array([getattr(post, name) for post in self.posts])
+
+    def set_scores(self, similarity: np.ndarray, primary: np.ndarray, secondary: np.ndarray):
+        for post, sim, prim, sec in zip(self.posts, similarity.tolist(), primary.tolist(), secondary.tolist()):
+            post.similarity_score = sim
+            post.primary_score = prim
+            post.secondary_score = sec
+
+    def filter(self, min_similarity: float) -> "PostBatch":
+        return PostBatch(post for post in self.posts if post.similarity_score >= min_similarity)
+
+    def sorted(self) -> "PostBatch":
+        """Highest similarity first, ties broken by Reddit score; stable for full ties"""
+        return PostBatch(sorted(self.posts, key=rank_key, reverse=True))
+
+    def top(self, k: int, min_similarity: float = float("-inf")) -> "PostBatch":
+        """
+        The first k posts of filter(min_similarity).sorted(), without building or sorting the rest.
+
+        heapq.nlargest keeps a k-sized heap and orders ties exactly like the stable sort.
+        """
+        candidates = (post for post in self.posts if post.similarity_score >= min_similarity)
+        return PostBatch(heapq.nlargest(k, candidates, key=rank_key))
+
+    def to_reddit_objects(self, limit: Optional[int] = None, llm_reply: str = "Add your reply here") -> List[list]:
+        posts = self.posts if limit is None else self.posts[:limit]
+        return [post.to_reddit_object(llm_reply) for post in posts]
+
+    def to_records(self) -> List[Dict]:
+        return [post.to_dict() for post in self.posts]
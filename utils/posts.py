@@ -1,32 +1,31 @@
-import praw
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import pandas as pd
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from datetime import datetime
 import os 
-import re 
+import threading
+from contextvars import copy_context
 from dotenv import load_dotenv
-from itertools import combinations
+from utils.search_cache import search_cache
+from utils.subreddit_cache import subreddit_cache
+from utils.reddit_pool import RateLimitExhausted, reddit_executor, reddit_pool
+from utils.post_batch import Post, PostBatch
+from utils.rules import BODY_RULES, FLAIR_RULES, TITLE_RULES, RuleTimer, contains_url
+from utils.query_planner import plan_queries, record_query_yields
+from utils.corpus_idf import corpus_idf
+from utils.semantic_rank import SEMANTIC_RERANK_TOP, semantic_ranker
 from datetime import datetime, timedelta
 
 
 load_dotenv()
 
-reddit = praw.Reddit(
-    client_id=os.getenv("CLIENT_ID"),
-    client_secret=os.getenv("CLIENT_SECRET"),
-    user_agent=os.getenv("USER_AGENT"),
-)
-
-vectorizer = TfidfVectorizer(
-    stop_words='english',
-    max_features=5000,
-    ngram_range=(1, 3),
-    analyzer='word',
-    token_pattern=r'(?u)\b\w+\b'
-)
+# Maximum number of Reddit searches run in parallel by find_relevant_posts_extra
+SEARCH_CONCURRENCY = int(os.getenv("REDDIT_SEARCH_CONCURRENCY", "4"))
+# Incremental searches re-read this many seconds before the high-water mark, so posts
+# created in the mark's second or indexed by Reddit search late are still picked up
+MARK_OVERLAP_SECONDS = float(os.getenv("MARK_OVERLAP_SECONDS", "900"))
+
+
 def split_csv_string(csv_string: str) -> list:
     # Split the CSV string into a list of words based on commas
     words = csv_string.split(",")
@@ -41,106 +40,181 @@ def split_csv_string(csv_string: str) -> list:
     return [first_two_words, rest_of_words]
 
 
-def contains_url(post_body):
+def classify_promotional(submission) -> Optional[str]:
     """
-    Check if a Reddit post body contains a URL.
-    Returns True if URL is found, False otherwise.
+    Name of the promotional rule the submission trips, or None.
+
+    Title and body are each scanned once by a precompiled rule set (see
+    utils/rules.py); per-stage timings are recorded in rule_stats.
     """
-    # Common URL patterns
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    
-    # Reddit markdown URL pattern [text](url)
-    markdown_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-    
-    # Check for both raw URLs and markdown URLs
-    has_raw_url = bool(re.search(url_pattern, post_body))
-    has_markdown_url = bool(re.search(markdown_pattern, post_body))
-    
-    return has_raw_url or has_markdown_url
+    timer = RuleTimer()
+    title_lower = submission.title.lower()
+    body_lower = submission.selftext.lower()
+
+    if not body_lower:
+        return timer.stage("empty_body", "empty_body")
+
+    fired = TITLE_RULES.search(title_lower)
+    if fired:
+        return timer.stage("title", f"title:{fired}")
+    timer.stage("title")
+
+    fired = BODY_RULES.search(body_lower)
+    if fired:
+        return timer.stage("body", f"body:{fired}")
+    timer.stage("body")
+
+    # Check flair
+    if submission.link_flair_text and FLAIR_RULES.search(str(submission.link_flair_text).lower()):
+        return timer.stage("flair", "flair:ad_flair")
+    timer.stage("flair")
+
+    if len(body_lower) > 1000 : 
+        return timer.stage("long_body", "long_body")
+    timer.stage("long_body")
+
+    # Long-form ads: a link, lots of text, headers and bullets, and nobody talking
+    if submission.num_comments < 3 and len(body_lower.split()) > 300 and contains_url(body_lower):
+        headers = 0
+        bullets = 0
+        for line in body_lower.split('\n'):
+            line = line.strip()
+            if line.startswith('#'):
+                headers += 1
+            elif line.startswith(('*', '-', '+')):
+                bullets += 1
+        if headers > 3 and bullets > 3:
+            return timer.stage("long_form_ad", "long_form_ad")
+    timer.stage("long_form_ad")
+
+    return None
 
 
 def is_promotional(submission) -> bool:
+    return classify_promotional(submission) is not None
+    
+def submission_record(submission) -> Dict:
+    """Raw fields of a search result, plus the `is_promotional` verdict and the rule behind it"""
+    subreddit = getattr(submission, "subreddit", None)
+    # Listings carry the subscriber count; reading it from the
+    # Subreddit object instead would lazily fetch /about
+    subscribers = vars(submission).get("subreddit_subscribers")
+    if subreddit and subscribers is not None:
+        subreddit_cache.seed(subreddit.display_name, subscribers)
+    promo_rule = classify_promotional(submission)
+    return {
+        "id": submission.id,
+        "title": submission.title,
+        "selftext": submission.selftext,
+        "permalink": submission.permalink,
+        "score": submission.score,
+        "created_utc": submission.created_utc,
+        "num_comments": submission.num_comments,
+        "subreddit": subreddit.display_name if subreddit else None,
+        "subscribers": subscribers,
+        "author": submission.author.name if submission.author else None,
+        "is_promotional": promo_rule is not None,
+        "promo_rule": promo_rule,
+    }
 
-        title_lower = submission.title.lower()
-        
-        # Title prefix patterns
-        prefix_patterns = [
-            r'^\[(hiring|ad|advertisement|sponsored|promo|promotion|deal|sale|' \
-            r'discount|giveaway|contest|affiliate|referral)\]',
-            r'^\((hiring|ad|advertisement|sponsored|promo|promotion|deal|sale|' \
-            r'discount|giveaway|contest|affiliate|referral)\)',
-        ]
-        body_lower = submission.selftext.lower()
-        
-        if(not body_lower) :
-            return True
-        
-        if title_lower.startswith('[hiring]') or body_lower.startswith('[hiring]') or title_lower.startswith('hiring:'):
-            return True
-        
-        # General promotional patterns
-        promo_patterns = [
-            r'\d+%\s*off',
-            r'save\s*\$?\d+',
-            r'limited\s*time\s*offer',
-            r'click\s*here\s*to',
-            r'dm\s*for\s*promo',
-            r'discount\s*code',
-            r'exclusive\s*offer',
-            r'special\s*price',
-            r'^now\s*available',
-            r'buy\s*now',
-            r'order\s*now',
-            r'sale\s*ends',
-        ]
-        
-        # Check title patterns
-        if any(re.search(pattern, title_lower) for pattern in prefix_patterns + promo_patterns):
-            return True
-               
-        # Check flair
-        if submission.link_flair_text and any(term in str(submission.link_flair_text).lower() 
-            for term in ['ad', 'sponsored', 'advertisement', 'promotion']):
-            return True
-        
-        if "coupon code" in title_lower or "promo code" in title_lower or "hiring" in title_lower or "hiring" in body_lower or "hire" in title_lower:
-            return True
-        
-        
-        headers = [line for line in body_lower.split('\n') 
-              if line.strip().startswith('#')]
-        has_multiple_headers = len(headers) > 3
-        
+def search_reddit(search_query: str, limit: int, duration, sort: str = "relevance") -> Tuple[List[Dict], bool]:
+    """
+    Search all of Reddit and return the raw submission fields.
 
-        bullets = [line for line in body_lower.split('\n') 
-                if line.strip().startswith(('*', '-', '+'))]
-        has_bullets = len(bullets) > 3
-        
-        promotional_keywords = [
-            "pricing", "plans", "save", "free trial", 
-            "special offer", "key features", "pros and cons", "try for free",
-            "buy now", "coupon code"
-        ]
-        
-        # Count occurrences of keywords in title and body
-        keyword_count = sum(
-            1 for keyword in promotional_keywords 
-            if keyword in title_lower or keyword in body_lower
-        )
-    
-            
-        if contains_url(body_lower) and (len(body_lower.split()) > 300) and has_bullets and has_multiple_headers and submission.num_comments < 3 :
-            return True
-                               
-        if not body_lower and submission.num_comments < 3 :
-            return True  
-        
-        if len(body_lower) > 1000 : 
-            return True
-               
+    Results are shared across users through the process-wide search cache, so
+    overlapping queries hit Reddit once per TTL window. Each record carries the
+    `is_promotional` verdict; per-user filtering happens in fetch_reddit_posts.
+    RateLimitExhausted propagates, so callers can tell "out of quota" from "no results".
+
+    Args:
+        search_query (str): Search query string
+        limit (int): Maximum number of posts to fetch
+        duration (str): Time filter for the search (e.g., 'day', 'week')
+        sort (str): Reddit search sort order
+
+    Returns:
+        Tuple[List[Dict], bool]: Raw submission records in listing order, and False
+        if the search failed partway
+    """
+    def fetch():
+        records = []
+        try:
+            with reddit_pool.client() as reddit:
+                for submission in reddit.subreddit("all").search(
+                    search_query, sort=sort, time_filter=duration, limit=limit
+                ):
+                    records.append(submission_record(submission))
+        except RateLimitExhausted:
+            raise
+        except Exception as e:
+            print(f"Error fetching Reddit posts: {e}")
+            return records, False
+        return records, True
+
+    return search_cache.get_or_fetch(search_query, sort, duration, limit, fetch)
+
+def is_past_mark(record: Dict, mark: Optional[Dict], overlap: float = MARK_OVERLAP_SECONDS) -> bool:
+    """
+    True if the record is older than the high-water mark minus the overlap window.
+    Posts inside the window are fetched again; the seen index drops the ones already stored.
+    """
+    if not mark:
         return False
-    
-def fetch_reddit_posts(search_query: str, limit: int, duration, seen_posts, excluded_subs, reddit_posts) -> List[Dict]:
+    return record["created_utc"] < mark.get("created_utc", 0) - overlap
+
+def search_reddit_incremental(search_query: str, limit: int, duration, mark: Optional[Dict]) -> Tuple[List[Dict], Optional[Dict], bool]:
+    """
+    Fetch only submissions newer than a high-water mark using `sort="new"`.
+
+    Pagination stops once the listing is MARK_OVERLAP_SECONDS past the mark, so
+    repeated runs only download what was posted (or indexed) since shortly
+    before the previous one. A shared cache entry
+    for the same query is reused when present; partial listings are not cached.
+
+    Args:
+        search_query (str): Search query string
+        limit (int): Maximum number of posts to fetch
+        duration (str): Time filter for the search
+        mark (dict): {"created_utc", "fullname"} of the newest post seen last run, or None
+
+    Returns:
+        Tuple[List[Dict], Optional[Dict], bool]: New raw records, the updated mark,
+        and False if the search failed partway
+    """
+    records = search_cache.get(search_query, "new", duration, limit)
+    if records is not None:
+        records = [record for record in records if not is_past_mark(record, mark)]
+    else:
+        records = []
+        reached_mark = False
+        try:
+            with reddit_pool.client() as reddit:
+                for submission in reddit.subreddit("all").search(
+                    search_query, sort="new", time_filter=duration, limit=limit
+                ):
+                    record = submission_record(submission)
+                    if is_past_mark(record, mark):
+                        reached_mark = True
+                        break
+                    records.append(record)
+        except RateLimitExhausted:
+            # The mark is untouched, so the next run fetches the gap
+            raise
+        except Exception as e:
+            print(f"Error fetching Reddit posts: {e}")
+            # Keep the old mark so the next run retries the gap
+            return records, mark, False
+        if not reached_mark:
+            search_cache.set(search_query, "new", duration, limit, records)
+
+    newest = max(records, key=lambda record: record["created_utc"], default=None)
+    # Only the overlap window came back: the old mark is still the newest post seen
+    if newest is None or (mark and newest["created_utc"] <= mark.get("created_utc", 0)):
+        return records, mark, True
+    return records, {"created_utc": newest["created_utc"], "fullname": f"t3_{newest['id']}"}, True
+
+def fetch_reddit_posts(search_query: str, limit: int, duration, seen_posts, excluded_subs, reddit_posts,
+                       high_water_marks: Optional[Dict[str, Dict]] = None) -> Tuple[List[Post], bool]:
     """
     Fetch posts from all of Reddit based on a search query.
 
@@ -150,9 +224,12 @@ def fetch_reddit_posts(search_query: str, limit: int, duration, seen_posts, excl
         duration (str): Time filter for the search (e.g., 'day', 'week')
         seen_posts (set): A set of post identifiers to avoid duplicates
         excluded_subs (list or set): List of subreddit names to exclude (case-insensitive)
+        reddit_posts (set or list): Ids of posts the user already has, or their post dicts
+        high_water_marks (dict): If given, fetch incrementally with sort="new" from the
+            mark stored for this query and update it in place
 
     Returns:
-        List[Dict]: List of posts with their details
+        Tuple[List[Post], bool]: Posts with their details, and False if the search failed partway
     """
     posts = []
     excluded_set = set()
@@ -162,65 +239,147 @@ def fetch_reddit_posts(search_query: str, limit: int, duration, seen_posts, excl
     else:
         excluded_set = {s.lower() for s in excluded_subs}
         
-    existing_post_ids=set()
-    existing_post_ids = {post["id"] for post in reddit_posts}
-    try:
-        for submission in reddit.subreddit("all").search(
-            search_query, sort="relevance", time_filter=duration, limit=limit
-        ):
-            # Ignore promotional posts
-            if is_promotional(submission):
-                continue
+    # Either the ids from FirestoreService.get_seen_index or full post dicts
+    if isinstance(reddit_posts, (set, frozenset)):
+        existing_post_ids = reddit_posts
+    else:
+        existing_post_ids = {post["id"] for post in reddit_posts}
+
+    if high_water_marks is not None:
+        records, mark, complete = search_reddit_incremental(search_query, limit, duration, high_water_marks.get(search_query))
+        if mark:
+            high_water_marks[search_query] = mark
+    else:
+        records, complete = search_reddit(search_query, limit, duration)
 
-            # Ignore posts older than a day if `duration == 'day'`
-            print(duration)
-            if duration == "day":
-                print("cron job filter")
-                post_age = datetime.utcnow() - datetime.utcfromtimestamp(submission.created_utc)
-                if submission.id in existing_post_ids :
-                    print("duplicate found")
-                    continue
-                if post_age > timedelta(days=1):
-                    continue
-            # print("Current UTC time:", datetime.utcnow())
-            # print("Post creation time:", datetime.utcfromtimestamp(submission.created_utc))
-            # post_age = datetime.utcnow() - datetime.utcfromtimestamp(submission.created_utc)
-            # print("Post age:", post_age)
-            # if post_age > timedelta(days=1):
-            #     continue
-
-            # Validate subreddit details
-            subreddit = getattr(submission, "subreddit", None)  
-            if not subreddit or getattr(subreddit, "subscribers", 0) < 100:
+    for record in records:
+        # Ignore promotional posts
+        if record["is_promotional"]:
+            continue
+
+        # Ignore posts older than a day if `duration == 'day'`
+        if duration == "day":
+            post_age = datetime.utcnow() - datetime.utcfromtimestamp(record["created_utc"])
+            if record["id"] in existing_post_ids :
+                print("duplicate found")
                 continue
-   
-            # Exclude specific subreddits
-            if subreddit.display_name.lower() in excluded_set:
+            if post_age > timedelta(days=1):
                 continue
 
-            # Normalize title to avoid duplicate posts
-            normalized_title = "".join(submission.title.lower().split())
+        if not record["subreddit"]:
+            continue
+
+        # Exclude specific subreddits before any metadata lookup
+        if record["subreddit"].lower() in excluded_set:
+            continue
+
+        # Validate subreddit details
+        subscribers = subreddit_subscribers(record)
+        if subscribers is not None and subscribers < 100:
+            continue
+
+        post_identifier = (record["author"], normalize_title(record["title"]))
+
+        if post_identifier in seen_posts:
+            continue  
+
+        posts.append(post_from_record(record))
+        seen_posts.add(post_identifier)
+
+    return posts, complete
+
+def subreddit_subscribers(record: Dict) -> Optional[int]:
+    """
+    Subscriber count for a record's subreddit, from the listing or the metadata cache.
+    None when it could not be fetched right now; callers skip the subscriber filter then.
+    """
+    if record["subscribers"] is not None:
+        return record["subscribers"]
+    cached = subreddit_cache.get(record["subreddit"])
+    if cached and cached["subscribers"] is not None:
+        return cached["subscribers"]
+    try:
+        with reddit_pool.client() as reddit:
+            return subreddit_cache.lookup(record["subreddit"], reddit)["subscribers"]
+    except RateLimitExhausted as e:
+        # Out of quota: unknown size, so the post skips the subscriber filter rather than being dropped
+        print(e)
+        return None
+
+def post_from_record(record: Dict) -> Post:
+    return Post(
+        id=record["id"],
+        title=record["title"],
+        body=record["selftext"],
+        url=f"https://reddit.com{record['permalink']}",
+        score=record["score"],
+        created_utc=datetime.fromtimestamp(record["created_utc"]),
+        num_comments=record["num_comments"],
+        subreddit=record["subreddit"],
+        author=record["author"],
+    )
+
+def normalize_title(title: str) -> str:
+    # Normalize title to avoid duplicate posts
+    return "".join(title.lower().split())
+
+
+def fetch_reddit_posts_concurrently(search_queries: List[str], limit: int, duration, seen_posts, excluded_subs, reddit_posts,
+                                    max_concurrency: int = SEARCH_CONCURRENCY,
+                                    query_yields: Optional[Dict[str, int]] = None,
+                                    high_water_marks: Optional[Dict[str, Dict]] = None) -> List[Post]:
+    """
+    Run one Reddit search per query in parallel and merge the results.
+
+    Every search gets its own dedup set while it runs; the results are then
+    merged into `seen_posts` in query order, so the output is the same as
+    running the searches one after another.
+
+    Args:
+        search_queries (List[str]): Search query strings, in priority order
+        max_concurrency (int): Maximum number of searches in flight at once
+        query_yields (dict): If given, filled with the number of new posts each completed query
+            contributed; searches that failed partway are left out
+        high_water_marks (dict): Per-query marks for incremental fetching, updated in place
+
+    Returns:
+        List[Post]: Deduplicated posts from all queries
+    """
+    if not search_queries:
+        return []
+
+    def fetch(search_query):
+        print("query:", search_query)
+        return fetch_reddit_posts(search_query, limit, duration, set(), excluded_subs, reddit_posts, high_water_marks)
 
-            author = submission.author.name if submission.author else None
-            post_identifier = (author, normalized_title)
+    workers = max(1, min(max_concurrency, len(search_queries)))
+    if workers == 1:
+        chunk_results = [fetch(search_query) for search_query in search_queries]
+    else:
+        # The shared executor keeps its threads, and with them their PRAW clients; this
+        # call holds at most `workers` of them. Each search runs in a copy of the caller's
+        # context so per-caller request counting and quota waiting follow it.
+        in_flight = threading.Semaphore(workers)
+        futures = []
+        for search_query in search_queries:
+            in_flight.acquire()
+            future = reddit_executor.submit(copy_context().run, fetch, search_query)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        chunk_results = [future.result() for future in futures]
 
+    posts = []
+    for search_query, (chunk_posts, complete) in zip(search_queries, chunk_results):
+        new_posts = 0
+        for post in chunk_posts:
+            post_identifier = (post.author, normalize_title(post.title))
             if post_identifier in seen_posts:
-                continue  
-
-            posts.append({
-                "id": submission.id,
-                "title": submission.title,
-                "body": submission.selftext,
-                "url": f"https://reddit.com{submission.permalink}",
-                "score": submission.score,
-                "created_utc": datetime.fromtimestamp(submission.created_utc),
-                "num_comments": submission.num_comments,
-                "subreddit": subreddit.display_name
-            })
+                continue
             seen_posts.add(post_identifier)
-    
-    except Exception as e:
-        print(f"Error fetching Reddit posts: {e}")
+            posts.append(post)
+            new_posts += 1
+        if query_yields is not None and complete:
+            query_yields[search_query] = new_posts
 
     return posts
 
@@ -260,7 +419,11 @@ def find_relevant_posts(primary_keywords: List[str],
                        duration: str,
                        min_similarity: float = 0.1,
                        primary_weight: float = 0.7,
-                       secondary_weight: float = 0.3) -> pd.DataFrame:
+                       secondary_weight: float = 0.3,
+                       query_history: Optional[Dict[str, Dict]] = None,
+                       high_water_marks: Optional[Dict[str, Dict]] = None,
+                       semantic_query: Optional[str] = None,
+                       top_k: Optional[int] = None) -> PostBatch:
     """
     Find posts relevant to given primary and secondary keywords
     
@@ -271,14 +434,21 @@ def find_relevant_posts(primary_keywords: List[str],
         min_similarity (float): Minimum combined similarity score
         primary_weight (float): Weight for primary keyword similarity (0-1)
         secondary_weight (float): Weight for secondary keyword similarity (0-1)
+        query_history (dict): Per-query yield stats from past runs, updated in place
+        high_water_marks (dict): Per-query marks for incremental sort="new" fetching, updated in place
+        semantic_query (str): Text for the optional semantic re-rank, e.g. the company description;
+            defaults to the keywords
+        top_k (int): Return only the k best posts; None returns every post above min_similarity
         
     Returns:
-        pd.DataFrame: Sorted dataframe of relevant posts
+        PostBatch: Relevant posts, highest similarity first
     """
     if True : 
         return find_relevant_posts_extra(primary_keywords,
                        secondary_keywords,
-                       limit, excluded_subs, reddit_posts,duration, min_similarity)
+                       limit, excluded_subs, reddit_posts,duration, min_similarity,
+                       query_history=query_history, high_water_marks=high_water_marks,
+                       semantic_query=semantic_query, top_k=top_k)
 
 def find_relevant_posts_extra(primary_keywords: List[str],
                        secondary_keywords: List[str],
@@ -288,7 +458,12 @@ def find_relevant_posts_extra(primary_keywords: List[str],
                        duration: str,
                        min_similarity: float = 0.1,
                        primary_weight: float = 0.7,
-                       secondary_weight: float = 0.3) -> pd.DataFrame:
+                       secondary_weight: float = 0.3,
+                       max_concurrency: int = SEARCH_CONCURRENCY,
+                       query_history: Optional[Dict[str, Dict]] = None,
+                       high_water_marks: Optional[Dict[str, Dict]] = None,
+                       semantic_query: Optional[str] = None,
+                       top_k: Optional[int] = None) -> PostBatch:
     """
     Find posts relevant to given primary and secondary keywords
     
@@ -299,9 +474,15 @@ def find_relevant_posts_extra(primary_keywords: List[str],
         min_similarity (float): Minimum combined similarity score
         primary_weight (float): Weight for primary keyword similarity (0-1)
         secondary_weight (float): Weight for secondary keyword similarity (0-1)
+        max_concurrency (int): Maximum number of Reddit searches run in parallel
+        query_history (dict): Per-query yield stats from past runs, updated in place
+        high_water_marks (dict): Per-query marks for incremental sort="new" fetching, updated in place
+        semantic_query (str): Text for the optional semantic re-rank, e.g. the company description;
+            defaults to the keywords
+        top_k (int): Return only the k best posts; None returns every post above min_similarity
         
     Returns:
-        pd.DataFrame: Sorted dataframe of relevant posts
+        PostBatch: Relevant posts, highest similarity first
     """
     if primary_keywords == [""]:
         primary_keywords = secondary_keywords.copy()
@@ -314,51 +495,85 @@ def find_relevant_posts_extra(primary_keywords: List[str],
     #     search_query = ' OR '.join(f'"{kw}"' for kw in primary_keywords)
         
     # primary_chunks = chunk_multi_word_keywords(primary_keywords)
-    primary_chunks = list(combinations(primary_keywords, 2))
-    if not primary_chunks: 
-        primary_chunks=primary_keywords
-    print("Primary chunks:", primary_chunks)
-    # Fetch posts for each chunk
-    all_posts = []
+    plan = plan_queries(primary_keywords, query_history)
+    print("Query plan:", plan.to_dict())
+    # Fetch posts for each planned query
     seen_posts = set()
-    
-    for chunk in primary_chunks:
-        # search_query = create_reddit_search_query(chunk)
-        if len(primary_keywords) == 1: 
-            search_query = primary_keywords[0]
-        else:     
-            search_query = ' OR '.join(f'"{kw}"' for kw in chunk)
-        print("query:", search_query)
-        chunk_posts = fetch_reddit_posts(search_query, limit, duration, seen_posts, excluded_subs, reddit_posts)
-        all_posts.extend(chunk_posts)
+    query_yields = {}
+
+    all_posts = fetch_reddit_posts_concurrently(
+        plan.search_queries(), limit, duration, seen_posts, excluded_subs, reddit_posts, max_concurrency,
+        query_yields=query_yields, high_water_marks=high_water_marks
+    )
+    if query_history is not None:
+        record_query_yields(query_history, plan, query_yields)
     
     # Fetch posts using Reddit's search
     # all_posts = fetch_reddit_posts(search_query, limit, duration)
     
-    if not all_posts:
-        return pd.DataFrame()
+    # The semantic re-rank needs its whole window from the lexical stage, not just top_k
+    lexical_k = top_k
+    if top_k is not None and semantic_ranker.enabled:
+        lexical_k = max(top_k, SEMANTIC_RERANK_TOP)
+    results = score_posts(all_posts, primary_keywords, secondary_keywords,
+                          min_similarity, primary_weight, secondary_weight, top_k=lexical_k)
+    
+    # Optional embedding re-rank of the lexical winners (SEMANTIC_RERANK=true); only the
+    # re-ranked window is returned, so every result carries a comparable blended score
+    if semantic_ranker.enabled:
+        results = semantic_ranker.rerank(
+            results, semantic_query or ' '.join(primary_keywords + secondary_keywords),
+            top=lexical_k or SEMANTIC_RERANK_TOP
+        )
+    return results if top_k is None else results[:top_k]
+
+
+def score_posts(all_posts: List[Post],
+                primary_keywords: List[str],
+                secondary_keywords: List[str],
+                min_similarity: float = 0.1,
+                primary_weight: float = 0.7,
+                secondary_weight: float = 0.3,
+                top_k: Optional[int] = None) -> PostBatch:
+    """
+    Score fetched posts against primary and secondary keywords
+    
+    Args:
+        all_posts (List[Post]): Posts as returned by fetch_reddit_posts
+        primary_keywords (List[str]): List of primary keywords
+        secondary_keywords (List[str]): List of secondary/context keywords
+        min_similarity (float): Minimum combined similarity score
+        primary_weight (float): Weight for primary keyword similarity (0-1)
+        secondary_weight (float): Weight for secondary keyword similarity (0-1)
+        top_k (int): Keep only the k best posts with a bounded heap instead of sorting them all
+        
+    Returns:
+        PostBatch: Relevant posts, highest similarity first
+    """
+    batch = PostBatch(all_posts)
+    if batch.empty:
+        return batch
     
     # Combine title and body for text analysis
-    posts_text = [f"{post['title']} {post['body']}" for post in all_posts]
+    posts_text = batch.texts()
     
     # Calculate TF-IDF similarity scores
     primary_query = ' '.join(primary_keywords)
     secondary_query = ' '.join(secondary_keywords)
     
-    # Vectorize posts and both keyword queries
-    tfidf_matrix = vectorizer.fit_transform(
-        posts_text + [primary_query, secondary_query]
-    )
+    # Vectorize posts against the shared corpus IDF; new posts are counted into it first
+    posts_matrix = corpus_idf.transform(posts_text, ids=[post.id for post in batch])
+    query_matrix = corpus_idf.transform([primary_query, secondary_query])
     
     # Calculate similarity scores for both keyword sets
     primary_similarities = cosine_similarity(
-        tfidf_matrix[-2:-1], 
-        tfidf_matrix[:-2]
+        query_matrix[0:1], 
+        posts_matrix
     )[0]
     
     secondary_similarities = cosine_similarity(
-        tfidf_matrix[-1:], 
-        tfidf_matrix[:-2]
+        query_matrix[1:2], 
+        posts_matrix
     )[0]
     
     # Calculate keyword presence scores
@@ -380,20 +595,12 @@ def find_relevant_posts_extra(primary_keywords: List[str],
         secondary_weight * combined_secondary_scores
     )
     
-    # Create DataFrame with results
-    results_df = pd.DataFrame(all_posts)
-    results_df['similarity_score'] = final_scores
-    results_df['primary_score'] = combined_primary_scores
-    results_df['secondary_score'] = combined_secondary_scores
+    batch.set_scores(final_scores, combined_primary_scores, combined_secondary_scores)
     
     # Filter and sort results
-    relevant_posts = results_df[results_df['similarity_score'] >= min_similarity]
-    relevant_posts = relevant_posts.sort_values(
-        by=['similarity_score', 'score'], 
-        ascending=[False, False]
-    )
-    
-    return relevant_posts
+    if top_k is not None:
+        return batch.top(top_k, min_similarity)
+    return batch.filter(min_similarity).sorted()
 
 
 def chunk_multi_word_keywords(keywords: List[str], max_words: int = 2) -> List[List[str]]:
@@ -0,0 +1,155 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Reddit rejects search queries longer than 512 characters
+MAX_QUERY_LENGTH = 512
+# Very broad OR-queries hit the listing cap and lose recall, so bound the term count too
+MAX_TERMS_PER_QUERY = int(os.getenv("QUERY_MAX_TERMS", "5"))
+# Queries averaging fewer new posts per run than this are dropped...
+MIN_MARGINAL_YIELD = float(os.getenv("QUERY_MIN_YIELD", "0.5"))
+# ...once they have this many runs of history
+MIN_RUNS_BEFORE_DROP = 3
+# Dropped queries are re-probed after being skipped this many times
+REPROBE_AFTER = 5
+
+
+@dataclass
+class PlannedQuery:
+    query: str
+    keywords: List[str]
+    expected_yield: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return {"query": self.query, "keywords": self.keywords, "expected_yield": self.expected_yield}
+
+
+@dataclass
+class QueryPlan:
+    queries: List[PlannedQuery] = field(default_factory=list)
+    dropped: List[PlannedQuery] = field(default_factory=list)
+
+    @property
+    def expected_calls(self) -> int:
+        return len(self.queries)
+
+    def search_queries(self) -> List[str]:
+        return [planned.query for planned in self.queries]
+
+    def to_dict(self) -> Dict:
+        return {
+            "queries": [planned.to_dict() for planned in self.queries],
+            "dropped": [planned.to_dict() for planned in self.dropped],
+            "expected_calls": self.expected_calls,
+        }
+
+
+def build_query(keywords: List[str]) -> str:
+    if len(keywords) == 1:
+        return keywords[0]
+    return ' OR '.join(f'"{kw}"' for kw in keywords)
+
+
+def pack_keywords(keywords: List[str],
+                  max_length: int = MAX_QUERY_LENGTH,
+                  max_terms: int = MAX_TERMS_PER_QUERY) -> List[List[str]]:
+    """
+    Pack keywords into the fewest OR-queries that respect the length and term limits.
+
+    Uses first-fit decreasing on the quoted keyword length, then restores the
+    original keyword order inside each query so query strings stay stable
+    between runs (they are the keys of the yield history).
+    """
+    order = {kw: i for i, kw in enumerate(keywords)}
+    bins: List[List[str]] = []
+    lengths: List[int] = []
+
+    for kw in sorted(keywords, key=lambda k: len(k), reverse=True):
+        cost = len(kw) + 2  # quotes
+        for i, chunk in enumerate(bins):
+            # " OR " separator between terms
+            if len(chunk) < max_terms and lengths[i] + 4 + cost <= max_length:
+                chunk.append(kw)
+                lengths[i] += 4 + cost
+                break
+        else:
+            bins.append([kw])
+            lengths.append(cost)
+
+    packed = [sorted(chunk, key=order.get) for chunk in bins]
+    return sorted(packed, key=lambda chunk: order[chunk[0]])
+
+
+def estimate_yield(query: str, history: Dict[str, Dict]) -> Optional[float]:
+    """Average number of new posts the query contributed per past run, or None without history"""
+    stats = history.get(query)
+    if not stats or not stats.get("runs"):
+        return None
+    return stats["new_posts"] / stats["runs"]
+
+
+def plan_queries(keywords: List[str], history: Optional[Dict[str, Dict]] = None,
+                 max_length: int = MAX_QUERY_LENGTH,
+                 max_terms: int = MAX_TERMS_PER_QUERY,
+                 min_yield: float = MIN_MARGINAL_YIELD) -> QueryPlan:
+    """
+    Build the list of Reddit search queries for a keyword set.
+
+    Args:
+        keywords (List[str]): Keywords to search for
+        history (dict): Per-query stats from previous runs, keyed by query string
+        max_length (int): Maximum query length in characters
+        max_terms (int): Maximum keywords OR'ed into one query
+        min_yield (float): Average new posts per run below which a query is dropped
+
+    Returns:
+        QueryPlan: Queries to run and queries dropped for low yield
+    """
+    history = history or {}
+    keywords = list(dict.fromkeys(kw.strip() for kw in keywords if kw.strip()))
+    plan = QueryPlan()
+
+    for chunk in pack_keywords(keywords, max_length, max_terms):
+        query = build_query(chunk)
+        planned = PlannedQuery(query, chunk, estimate_yield(query, history))
+        stats = history.get(query, {})
+        low_yield = (
+            planned.expected_yield is not None
+            and stats.get("runs", 0) >= MIN_RUNS_BEFORE_DROP
+            and planned.expected_yield < min_yield
+        )
+        if low_yield and stats.get("skipped", 0) < REPROBE_AFTER:
+            plan.dropped.append(planned)
+        else:
+            plan.queries.append(planned)
+
+    # Never plan zero searches; keep the best of the dropped queries instead
+    if not plan.queries and plan.dropped:
+        best = max(plan.dropped, key=lambda planned: planned.expected_yield or 0)
+        plan.dropped.remove(best)
+        plan.queries.append(best)
+
+    return plan
+
+
+def record_query_yields(history: Dict[str, Dict], plan: QueryPlan, query_yields: Dict[str, int]):
+    """
+    Update the history in place with the new posts each planned query contributed this run.
+
+    Queries missing from query_yields (the search failed or was cut short) are
+    left as they were, so an outage is not mistaken for a run with no new posts.
+    """
+    for planned in plan.queries:
+        if planned.query not in query_yields:
+            continue
+        stats = history.setdefault(planned.query, {"runs": 0, "new_posts": 0, "skipped": 0})
+        stats["runs"] += 1
+        stats["new_posts"] += query_yields[planned.query]
+        stats["skipped"] = 0
+    for planned in plan.dropped:
+        stats = history.setdefault(planned.query, {"runs": 0, "new_posts": 0, "skipped": 0})
+        stats["skipped"] = stats.get("skipped", 0) + 1
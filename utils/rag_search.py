@@ -1,6 +1,8 @@
 from openai import OpenAI
 from pinecone import Pinecone
 import os 
+import threading
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 
@@ -11,6 +13,14 @@ pc = Pinecone(api_key=os.getenv("PINECONE_KEY"))
 index_host = os.getenv("PINECONE_HOST")
 namespace = "test"
 
+# Docs up to this size are sent with every /reply in the cached prompt prefix
+# (~4 chars per token, so the default stays well under 5k tokens)
+PINNED_DOCS_MAX_CHARS = int(os.getenv("PINNED_DOCS_MAX_CHARS", "16000"))
+# A user's docs change only on upload, so the listing is reused for this long
+PINNED_DOCS_TTL = float(os.getenv("PINNED_DOCS_TTL", "600"))
+_pinned_docs_cache = TTLCache(maxsize=1024, ttl=PINNED_DOCS_TTL)
+_pinned_docs_lock = threading.Lock()
+
 import tiktoken
 
 def count_tokens(text: str, model: str = "text-embedding-3-small") -> int:
@@ -144,4 +154,40 @@ def get_all_user_docs(user_id: str):
         
     except Exception as e:
         print(f"Error retrieving user documents: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+def pinned_company_docs(user_id: str, max_chars: int = PINNED_DOCS_MAX_CHARS):
+    """
+    The user's docs as one stable text for the cached reply prefix.
+
+    Docs are joined oldest first, so a new upload only appends, and the text
+    stops at the last whole doc within `max_chars`.
+
+    Args:
+        user_id: Unique user identifier
+        max_chars: Size budget for the joined docs
+
+    Returns:
+        (text, complete): complete is False when docs were left out or none
+        could be read, in which case callers should still retrieve per post
+    """
+    with _pinned_docs_lock:
+        cached = _pinned_docs_cache.get((user_id, max_chars))
+    if cached is not None:
+        return cached
+
+    documents = sorted(get_all_user_docs(user_id), key=lambda doc: (doc.get("uploaded_at", ""), doc["id"]))
+    contents = [doc["content"].strip() for doc in documents if doc["content"].strip()]
+    snippets = []
+    size = 0
+    for content in contents:
+        if size + len(content) > max_chars:
+            break
+        snippets.append(content)
+        size += len(content) + 2
+    # An empty listing may be a Pinecone error, so it never replaces retrieval
+    result = ("\n\n".join(snippets), bool(contents) and len(snippets) == len(contents))
+    with _pinned_docs_lock:
+        _pinned_docs_cache[(user_id, max_chars)] = result
+    return result
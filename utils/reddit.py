@@ -1,11 +1,17 @@
-import praw
-import re
 from dotenv import load_dotenv
 import os
+import threading
+import time
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from itertools import chain
+from concurrent.futures import wait
+from contextvars import copy_context
+from utils.subreddit_cache import subreddit_cache
+from utils.reddit_pool import RateLimitExhausted, reddit_executor, reddit_pool, wait_for_quota
+from utils.subreddit_catalog import CatalogEntry, get_subreddit_catalog
+from utils.rules import keyword_pattern
 # from openai import OpenAI
 
 # Load environment variables
@@ -13,12 +19,11 @@ load_dotenv()
 
 # client = OpenAI()
 
-# Initialize Reddit API
-reddit = praw.Reddit(
-    client_id=os.getenv("CLIENT_ID"),
-    client_secret=os.getenv("CLIENT_SECRET"),
-    user_agent=os.getenv("USER_AGENT"),
-)
+# Reddit reads go through the shared multi-credential pool
+
+# Subreddits scored in parallel by rank_subreddits, and its time budget in seconds
+RANK_CONCURRENCY = int(os.getenv("RANK_CONCURRENCY", "8"))
+RANK_DEADLINE_SECONDS = float(os.getenv("RANK_DEADLINE_SECONDS", "20"))
 
 # Helper functions
 
@@ -44,18 +49,57 @@ reddit = praw.Reddit(
 
 
 def calculate_relevancy(subreddit, keywords):
-    keyword_pattern = r'\b(?:' + '|'.join(re.escape(keyword.lower()) for keyword in keywords) + r')\b'
+    # Compiled once per keyword set instead of once per subreddit
+    pattern = keyword_pattern(keywords)
     title = subreddit.title.lower()
     description = subreddit.public_description.lower()
-    title_matches = len(set(re.findall(keyword_pattern, title)))
-    description_matches = len(set(re.findall(keyword_pattern, description)))
+    title_matches = len(set(pattern.findall(title)))
+    description_matches = len(set(pattern.findall(description)))
     score = (2 * title_matches) + description_matches
     return score
 
+def live_search_subreddits(keyword, limit):
+    """Search Reddit for a keyword and store every result in the local catalog"""
+    with reddit_pool.client() as reddit:
+        entries = []
+        for subreddit in reddit.subreddits.search(keyword, limit=limit):
+            subreddit_cache.seed_from_subreddit(subreddit)
+            entries.append(CatalogEntry(
+                subreddit.display_name,
+                subreddit.title,
+                subreddit.public_description,
+                subreddit.subscribers,
+                subreddit.active_user_count,
+            ))
+    catalog = get_subreddit_catalog()
+    if catalog is not None:
+        catalog.upsert(entries)
+        catalog.mark_searched(keyword)
+    return entries
+
 def search_subreddits(keywords, limit):
+    """
+    Find subreddits for the keywords, answering from the local catalog and
+    searching Reddit live only for keywords that are missing or stale there.
+    """
+    catalog = get_subreddit_catalog()
+    if catalog is not None:
+        catalog.start_background_refresh(lambda keyword: live_search_subreddits(keyword, 50))
     subreddits = {}
     for keyword in keywords:
-        for subreddit in reddit.subreddits.search(keyword, limit=limit):
+        if catalog is not None and catalog.is_fresh(keyword):
+            results = catalog.search(keyword, limit)
+        else:
+            try:
+                results = live_search_subreddits(keyword, limit)
+            except RateLimitExhausted as e:
+                # Serve whatever the catalog has instead of waiting for quota
+                print(e)
+                if catalog is None:
+                    raise
+                results = catalog.search(keyword, limit)
+
+        for subreddit in results:
             relevancy_score = calculate_relevancy(subreddit, keywords)
             if (subreddit.subscribers is not None) and subreddit.subscribers > 10000 and relevancy_score > 0: 
                 subreddits[subreddit.display_name] = {
@@ -68,16 +112,32 @@ def search_subreddits(keywords, limit):
                 }
     return subreddits
 
-def fetch_engagement(subreddit_name):
-    subreddit = reddit.subreddit(subreddit_name)
-    posts = chain(subreddit.hot(limit=10), subreddit.new(limit=10))
+def fetch_subreddit_listings(subreddit_name):
+    """
+    Fetch every listing the ranking scores need, once per subreddit.
+
+    `new` is shared between fetch_engagement and get_subreddit_activity_score
+    instead of being downloaded by each.
+    """
+    with reddit_pool.client() as reddit:
+        subreddit = reddit.subreddit(subreddit_name)
+        listings = {
+            "hot": [(post.num_comments, post.score, post.created_utc) for post in subreddit.hot(limit=10)],
+            "new": [(post.num_comments, post.score, post.created_utc) for post in subreddit.new(limit=10)],
+            "comments": [comment.created_utc for comment in subreddit.comments(limit=1000)],
+        }
+        listings["subscribers"] = subreddit_cache.lookup(subreddit_name, reddit)["subscribers"]
+    return listings
+
+def fetch_engagement(subreddit_name, listings=None):
+    listings = listings or fetch_subreddit_listings(subreddit_name)
     total_comments = 0
     total_upvotes = 0
     post_count = 0
 
-    for post in posts:
-        total_comments += post.num_comments
-        total_upvotes += post.score
+    for num_comments, score, _ in chain(listings["hot"], listings["new"]):
+        total_comments += num_comments
+        total_upvotes += score
         post_count += 1
     
     if post_count == 0: 
@@ -88,50 +148,93 @@ def fetch_engagement(subreddit_name):
         "avg_upvotes": total_upvotes / post_count,
     }
 
-def get_subreddit_activity_score(subreddit_name, lookback_days=90):
+def get_subreddit_activity_score(subreddit_name, lookback_days=90, listings=None):
+    listings = listings or fetch_subreddit_listings(subreddit_name)
     end_time = datetime.utcnow()
     start_time = end_time - timedelta(days=lookback_days)
-    subreddit = reddit.subreddit(subreddit_name)
     total_posts = 0
     total_comments = 0
     recent_post_time = None
     recent_comment_time = None
 
-    for submission in subreddit.new(limit=10):  
-        post_time = datetime.utcfromtimestamp(submission.created_utc)
+    for _, _, created_utc in listings["new"]:
+        post_time = datetime.utcfromtimestamp(created_utc)
         if post_time >= start_time:
             total_posts += 1
             if not recent_post_time or post_time > recent_post_time:
                 recent_post_time = post_time
 
-    for comment in subreddit.comments(limit=1000):
-        comment_time = datetime.utcfromtimestamp(comment.created_utc)
+    for created_utc in listings["comments"]:
+        comment_time = datetime.utcfromtimestamp(created_utc)
         if comment_time >= start_time:
             total_comments += 1
             if not recent_comment_time or comment_time > recent_comment_time:
                 recent_comment_time = comment_time
 
     recency_score = 100 if (recent_comment_time and recent_post_time and recent_post_time >= start_time) else 0
-    engagement_score = (total_posts + total_comments) / (subreddit.subscribers)
+    # Banned/private subreddits come back from the metadata cache with 0 subscribers
+    engagement_score = (total_posts + total_comments) / (listings["subscribers"] or 1)
     activity_score = (total_posts * 0.4) + (total_comments * 0.4) + (engagement_score * 0.2) + recency_score
 
     return activity_score
 
-def rank_subreddits(subreddits):
+def score_subreddit(name, data):
+    listings = fetch_subreddit_listings(name)
+    engagement = fetch_engagement(name, listings)
+    return {
+        "subreddit": name,
+        "engagement": engagement["avg_comments"] + engagement["avg_upvotes"],
+        "size": data["subscribers"],
+        "activity": get_subreddit_activity_score(name, listings=listings),
+        "relevance": data.get("relevance", 0) 
+    }
+
+def rank_subreddits(subreddits, max_concurrency=RANK_CONCURRENCY, deadline=RANK_DEADLINE_SECONDS):
+    """
+    Score candidate subreddits concurrently and return the top 5.
+
+    Subreddits not scored when the deadline hits are left out, so a slow run
+    returns a ranking of the partial results instead of timing out. Scoring
+    waits for Reddit quota within the deadline; if it is still exhausted,
+    RateLimitExhausted is raised rather than returning a ranking of whatever
+    got through.
+    """
+    if not subreddits:
+        return []
+
+    deadline_at = time.monotonic() + deadline
+    # At most max_concurrency of the shared Reddit threads work on this ranking at once
+    in_flight = threading.Semaphore(max(1, max_concurrency))
+    futures = {}
+    with wait_for_quota(deadline):
+        for name, data in subreddits.items():
+            if not in_flight.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+                break
+            # One context copy per task, so each worker sees the quota wait (and any request counter)
+            future = reddit_executor.submit(copy_context().run, score_subreddit, name, data)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures[name] = future
+    done, not_done = wait(futures.values(), timeout=max(0.0, deadline_at - time.monotonic()))
+    # Queued work is dropped; scorings already running finish in the background
+    for future in not_done:
+        future.cancel()
+    if len(done) < len(subreddits):
+        print(f"rank_subreddits deadline hit, ranking {len(done)} of {len(subreddits)} subreddits")
+
     ranked_list = []
-    for name, data in subreddits.items():
-        engagement = fetch_engagement(name)
-        engagement_score = engagement["avg_comments"] + engagement["avg_upvotes"]
-        size_score = data["subscribers"]
-        activity_score = get_subreddit_activity_score(name)
-
-        ranked_list.append({
-            "subreddit": name,
-            "engagement": engagement_score,
-            "size": size_score,
-            "activity": activity_score,
-            "relevance": data.get("relevance", 0) 
-        })
+    # Keep input order so the ranking does not depend on completion order
+    for name, future in futures.items():
+        if future not in done:
+            continue
+        try:
+            ranked_list.append(future.result())
+        except RateLimitExhausted:
+            raise
+        except Exception as e:
+            print(f"Error scoring r/{name}: {e}")
+
+    if not ranked_list:
+        return []
 
     df = pd.DataFrame(ranked_list)
     for col in ["engagement", "activity", "relevance"]:
@@ -0,0 +1,268 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Mapping, Optional
+
+import praw
+from dotenv import load_dotenv
+from prawcore.requestor import Requestor
+
+load_dotenv()
+
+# Stop handing out a credential when Reddit reports fewer remaining requests than this
+QUOTA_RESERVE = float(os.getenv("REDDIT_POOL_RESERVE", "5"))
+# Longest a background caller inside wait_for_quota() sleeps for a credential's quota to reset
+QUOTA_MAX_WAIT = float(os.getenv("REDDIT_POOL_MAX_WAIT", "600"))
+# Threads shared by every fan-out of Reddit reads (searches, subreddit scoring)
+REDDIT_WORKERS = int(os.getenv("REDDIT_WORKERS", "16"))
+
+
+class RequestCounter:
+    """Reddit requests made on behalf of one caller, e.g. one user in the cron"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def add(self, requests: int):
+        with self._lock:
+            self.requests += requests
+
+
+# Set by count_requests(); copied into threads by asyncio.to_thread and copy_context().run
+_request_counter: ContextVar[Optional[RequestCounter]] = ContextVar("reddit_request_counter", default=None)
+
+
+@contextmanager
+def count_requests():
+    """Attribute every pooled Reddit request made in this context to a fresh RequestCounter"""
+    counter = RequestCounter()
+    token = _request_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _request_counter.reset(token)
+
+
+# Seconds a caller is willing to sleep for quota; 0 (request handlers) raises RateLimitExhausted instead
+_max_wait: ContextVar[float] = ContextVar("reddit_max_wait", default=0.0)
+
+
+@contextmanager
+def wait_for_quota(max_wait: float = QUOTA_MAX_WAIT):
+    """
+    Let pooled requests made in this context sleep until a credential's quota
+    resets instead of raising, for batch and background callers like the cron.
+    RateLimitExhausted is still raised when the wait would exceed max_wait.
+    """
+    token = _max_wait.set(max_wait)
+    try:
+        yield
+    finally:
+        _max_wait.reset(token)
+
+
+def _sleep_for_quota(retry_after: float, deadline: float) -> bool:
+    """Sleep out retry_after if that ends before deadline (a time.monotonic() value)"""
+    if time.monotonic() + retry_after > deadline:
+        return False
+    print(f"Reddit quota exhausted, waiting {retry_after:.1f}s for the reset")
+    time.sleep(retry_after)
+    return True
+
+
+class RateLimitExhausted(Exception):
+    """Raised instead of sleeping when every credential is out of quota"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"All Reddit credentials are rate limited, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class PooledRequestor(Requestor):
+    """prawcore Requestor that reports every HTTP request to its pooled credential"""
+
+    def __init__(self, *args, on_request: Callable[[], None], on_response: Callable[[Mapping], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_request = on_request
+        self._on_response = on_response
+
+    def request(self, *args, **kwargs):
+        url = args[1] if len(args) > 1 else kwargs.get("url", "")
+        # Access-token requests go to www.reddit.com and do not count against the API quota
+        if not str(url).startswith(self.oauth_url):
+            return super().request(*args, **kwargs)
+        self._on_request()
+        response = super().request(*args, **kwargs)
+        self._on_response(response.headers)
+        return response
+
+
+class PooledCredential:
+    """One Reddit app credential with its own pacing and last known server-side quota"""
+
+    def __init__(self, name: str, client_id: str, client_secret: str, user_agent: str):
+        self.name = name
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_agent = user_agent
+        self.remaining: Optional[float] = None
+        self.reset_timestamp: Optional[float] = None
+        self.requests = 0
+        # Replaced by the pool's lock, so picking and per-request charging never race
+        self.lock = threading.Lock()
+        # PRAW instances are not thread safe, so each thread gets its own client per credential
+        self._local = threading.local()
+
+    def new_client(self, strict: bool = True) -> praw.Reddit:
+        """
+        A PRAW client charging each of its requests to this credential. A strict
+        client raises RateLimitExhausted before a request once the server-side
+        quota is down to the reserve (or waits, inside wait_for_quota), instead
+        of letting prawcore sleep until reset.
+        """
+        return praw.Reddit(
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            user_agent=self.user_agent,
+            requestor_class=PooledRequestor,
+            requestor_kwargs={"on_request": lambda: self.before_request(strict), "on_response": self.after_response},
+        )
+
+    def client(self) -> praw.Reddit:
+        reddit = getattr(self._local, "reddit", None)
+        if reddit is None:
+            reddit = self.new_client()
+            self._local.reddit = reddit
+        return reddit
+
+    def quota_left(self) -> bool:
+        if self.remaining is None or self.reset_timestamp is None:
+            return True
+        return self.remaining > QUOTA_RESERVE or time.time() >= self.reset_timestamp
+
+    def retry_after(self) -> float:
+        if self.quota_left():
+            return 0.0
+        return max(0.0, self.reset_timestamp - time.time())
+
+    def before_request(self, strict: bool = True):
+        """
+        Charge one request against the last quota Reddit reported, so every page
+        of a paginated listing counts and concurrent requests on the credential
+        see the quota shrink before their responses arrive.
+        """
+        deadline = time.monotonic() + _max_wait.get()
+        while True:
+            with self.lock:
+                if not strict or self.quota_left():
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    self.requests += 1
+                    break
+                retry_after = self.retry_after()
+            if not _sleep_for_quota(retry_after, deadline):
+                raise RateLimitExhausted(retry_after)
+        counter = _request_counter.get()
+        if counter is not None:
+            counter.add(1)
+
+    def after_response(self, headers: Mapping):
+        """Record the quota from the response's X-Ratelimit-* headers"""
+        if headers.get("x-ratelimit-remaining") is None:
+            return
+        with self.lock:
+            self.remaining = float(headers["x-ratelimit-remaining"])
+            if headers.get("x-ratelimit-reset") is not None:
+                self.reset_timestamp = time.time() + float(headers["x-ratelimit-reset"])
+
+
+class RedditClientPool:
+    """
+    Spreads read traffic across every configured Reddit credential.
+
+    Each credential tracks the remaining quota and reset time reported by
+    Reddit. `client()` hands out the credential with the most headroom and
+    raises RateLimitExhausted when none has any, so request handlers can
+    degrade instead of sleeping inside prawcore. Batch callers wrap their work
+    in wait_for_quota() to sleep until the earliest reset instead.
+    """
+
+    def __init__(self, credentials: List[PooledCredential]):
+        if not credentials:
+            raise ValueError("RedditClientPool needs at least one credential")
+        self.credentials = credentials
+        self._lock = threading.Lock()
+        for credential in credentials:
+            credential.lock = self._lock
+
+    @classmethod
+    def from_env(cls) -> "RedditClientPool":
+        """Load CLIENT_ID/CLIENT_SECRET/USER_AGENT, then the same names suffixed 2, 3, ..."""
+        credentials = []
+        suffix = ""
+        index = 1
+        while os.getenv(f"CLIENT_ID{suffix}"):
+            credentials.append(PooledCredential(
+                name=f"CLIENT_ID{suffix}",
+                client_id=os.getenv(f"CLIENT_ID{suffix}"),
+                client_secret=os.getenv(f"CLIENT_SECRET{suffix}"),
+                user_agent=os.getenv(f"USER_AGENT{suffix}") or os.getenv("USER_AGENT"),
+            ))
+            index += 1
+            suffix = str(index)
+        if not credentials:
+            # Keep the old behaviour of building a client from whatever is configured
+            credentials.append(PooledCredential("CLIENT_ID", os.getenv("CLIENT_ID"), os.getenv("CLIENT_SECRET"), os.getenv("USER_AGENT")))
+        return cls(credentials)
+
+    def _pick(self) -> PooledCredential:
+        deadline = time.monotonic() + _max_wait.get()
+        while True:
+            with self._lock:
+                eligible = [c for c in self.credentials if c.quota_left()]
+                if eligible:
+                    return max(eligible, key=lambda c: c.remaining if c.remaining is not None else float("inf"))
+                retry_after = min(c.retry_after() for c in self.credentials)
+            if not _sleep_for_quota(retry_after, deadline):
+                raise RateLimitExhausted(retry_after)
+
+    @contextmanager
+    def client(self):
+        """
+        Yield a PRAW client for one unit of work (e.g. one listing).
+
+        Every underlying HTTP request, including each page of a paginated
+        listing, is charged to the credential's quota and the caller's request
+        counter as it is made. If the credential's quota runs down mid-listing
+        the next request raises RateLimitExhausted, or waits for the reset
+        inside wait_for_quota().
+        """
+        yield self._pick().client()
+
+    def dedicated_client(self) -> praw.Reddit:
+        """
+        A fresh client on the credential with the most headroom, for long-lived consumers
+        like streams. Its requests are charged but it never raises; prawcore paces it.
+        """
+        with self._lock:
+            credential = max(self.credentials, key=lambda c: c.remaining if c.remaining is not None else float("inf"))
+        return credential.new_client(strict=False)
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [{
+                "credential": c.name,
+                "requests": c.requests,
+                "remaining": c.remaining,
+                "reset_timestamp": c.reset_timestamp,
+            } for c in self.credentials]
+
+
+reddit_pool = RedditClientPool.from_env()
+
+# Long-lived, so each worker thread keeps its PRAW clients (and their OAuth tokens) between calls
+reddit_executor = ThreadPoolExecutor(max_workers=REDDIT_WORKERS, thread_name_prefix="reddit")
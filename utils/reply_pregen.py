@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from utils.finder import build_reply_prompt, generate_reply_async
+from utils.rag_search import format_company_docs, pinned_company_docs, query_user_docs
+
+load_dotenv()
+
+# Draft replies for posts the nightly job stores, so opening a post is a Firestore read
+REPLY_PREGEN = os.getenv("REPLY_PREGEN", "true").lower() in ("1", "true", "yes")
+# Claude and Pinecone calls in flight at once across all users
+REPLY_PREGEN_CONCURRENCY = int(os.getenv("REPLY_PREGEN_CONCURRENCY", "8"))
+# Placeholder stored with every post until a reply is drafted
+PLACEHOLDER_REPLY = "Add your reply here"
+
+
+async def post_reply_prompt(profile, userid, title, content):
+    """
+    The /reply prompt for a post: the user's profile and docs in the cached
+    prefix, plus the docs most similar to the post when not all of them fit
+    """
+    # Pinecone and OpenAI embedding calls are blocking
+    pinned_docs, complete = await asyncio.to_thread(pinned_company_docs, userid)
+    company_docs = ""
+    if not complete:
+        company_docs = format_company_docs(await asyncio.to_thread(query_user_docs, userid, content, 3))
+    return build_reply_prompt(f"title:{title} content: {content}", profile.company_name, profile.company_description,
+                              profile.user_role, profile.sample_reply, profile.marketing_goals, company_docs, pinned_docs)
+
+
+async def pregenerate_replies(posts: List[Tuple[str, List]], service, concurrency: int = REPLY_PREGEN_CONCURRENCY,
+                              prompt=post_reply_prompt, generate=generate_reply_async) -> Dict:
+    """
+    Draft replies for stored posts with a bounded pool of concurrent generations
+    and write them back as suggestedReply.
+
+    A post whose generation fails keeps the placeholder, so the frontend falls
+    back to generating on click exactly as before.
+
+    Args:
+        posts: (user_id, reddit_object) pairs, as passed to FirestoreService.add_posts
+        service: FirestoreService (get_user_profile and set_suggested_replies)
+        concurrency: Generations in flight at once
+        prompt: Coroutine (profile, user_id, title, content) -> (system_prompt, user_prompt)
+        generate: Coroutine (system_prompt, user_prompt) -> reply text; swap in a stub to run without Claude
+
+    Returns:
+        Counts of drafted and failed posts, stored batches and the wall-clock time
+    """
+    started = time.perf_counter()
+    posts = [(user_id, reddit_object) for user_id, reddit_object in posts if reddit_object[4] == PLACEHOLDER_REPLY]
+    stats = {"posts": len(posts), "drafted": 0, "failed": 0, "batches": 0, "failed_batches": 0, "seconds": 0.0}
+    if not posts:
+        return stats
+
+    semaphore = asyncio.Semaphore(concurrency)
+    user_ids = list(dict.fromkeys(user_id for user_id, _ in posts))
+    profiles = dict(zip(user_ids, await asyncio.gather(*(service.get_user_profile(user_id) for user_id in user_ids))))
+
+    async def draft(user_id, reddit_object):
+        async with semaphore:
+            try:
+                reply = await generate(*await prompt(profiles[user_id], user_id, reddit_object[2], reddit_object[3]))
+            except Exception as e:
+                print(f"Drafting a reply for {reddit_object[0]} failed: {e}")
+                return None
+        # generate_reply_async reports API failures as text instead of raising
+        if not reply or reply.startswith("Error getting summary"):
+            print(f"Drafting a reply for {reddit_object[0]} failed: {reply}")
+            return None
+        return user_id, reddit_object[0], reply
+
+    drafts = await asyncio.gather(*(draft(user_id, reddit_object) for user_id, reddit_object in posts))
+    replies = [draft for draft in drafts if draft is not None]
+    stats["drafted"] = len(replies)
+    stats["failed"] = len(posts) - len(replies)
+    if replies:
+        report = await service.set_suggested_replies(replies)
+        stats["batches"] = len(report)
+        stats["failed_batches"] = sum(1 for entry in report if entry["error"])
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
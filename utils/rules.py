@@ -0,0 +1,147 @@
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class RuleSet:
+    """
+    A named set of regex rules compiled into one alternation.
+
+    A single `search` scans the text once and reports which rule matched
+    (via the named group that fired) instead of running re.search per rule.
+    """
+
+    def __init__(self, name: str, rules: List[Tuple[str, str]], flags: int = 0):
+        self.name = name
+        self.rule_names = [rule_name for rule_name, _ in rules]
+        self._groups = {f"r{i}": rule_name for i, (rule_name, _) in enumerate(rules)}
+        self.pattern = re.compile(
+            "|".join(f"(?P<r{i}>{pattern})" for i, (_, pattern) in enumerate(rules)), flags
+        )
+
+    def search(self, text: str) -> Optional[str]:
+        """Name of the rule matching earliest in the text, or None"""
+        match = self.pattern.search(text)
+        return self._groups[match.lastgroup] if match else None
+
+
+class RuleStats:
+    """Process-wide counters of how often each rule fired and how long each rule stage took"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def record(self, stage: str, elapsed: float, fired: Optional[str] = None):
+        with self._lock:
+            stats = self._stats.setdefault(stage, {"calls": 0, "seconds": 0.0, "fired": {}})
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            if fired:
+                stats["fired"][fired] = stats["fired"].get(fired, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {stage: {**stats, "fired": dict(stats["fired"])} for stage, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+rule_stats = RuleStats()
+
+
+class RuleTimer:
+    """Times consecutive rule stages of one evaluation and records them in rule_stats"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def stage(self, name: str, fired: Optional[str] = None) -> Optional[str]:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.timings[name] = elapsed
+        rule_stats.record(name, elapsed, fired)
+        return fired
+
+
+_PROMO_TERMS = r"hiring|ad|advertisement|sponsored|promo|promotion|deal|sale|discount|giveaway|contest|affiliate|referral"
+
+# Everything is_promotional checks on the lowercased title, in one pass
+TITLE_RULES = RuleSet("title", [
+    ("hiring_prefix", r"^\[hiring\]|^hiring:"),
+    ("bracket_prefix", rf"^\[(?:{_PROMO_TERMS})\]"),
+    ("paren_prefix", rf"^\((?:{_PROMO_TERMS})\)"),
+    ("percent_off", r"\d+%\s*off"),
+    ("save_amount", r"save\s*\$?\d+"),
+    ("limited_time_offer", r"limited\s*time\s*offer"),
+    ("click_here", r"click\s*here\s*to"),
+    ("dm_for_promo", r"dm\s*for\s*promo"),
+    ("discount_code", r"discount\s*code"),
+    ("exclusive_offer", r"exclusive\s*offer"),
+    ("special_price", r"special\s*price"),
+    ("now_available", r"^now\s*available"),
+    ("buy_now", r"buy\s*now"),
+    ("order_now", r"order\s*now"),
+    ("sale_ends", r"sale\s*ends"),
+    ("coupon_code", r"coupon code|promo code"),
+    ("hiring", r"hiring|hire"),
+])
+
+# Everything is_promotional checks on the lowercased body, in one pass
+BODY_RULES = RuleSet("body", [
+    ("hiring_prefix", r"^\[hiring\]"),
+    ("hiring", r"hiring"),
+])
+
+FLAIR_RULES = RuleSet("flair", [
+    ("ad_flair", r"ad|sponsored|advertisement|promotion"),
+])
+
+# Only the first character after the scheme matters for a yes/no answer, which
+# keeps the check linear; it accepts exactly what the old repeated class did
+_RAW_URL = re.compile(r"https?://[a-zA-Z0-9$-_@.&+!*(),]")
+_BRACKETS = re.compile(r"[\[\]]")
+
+
+def has_markdown_link(text: str) -> bool:
+    """
+    Linear-time equivalent of re.search(r'\\[([^\\]]+)\\]\\(([^)]+)\\)', text).
+
+    Walks the brackets once, remembering the earliest '[' since the last ']',
+    instead of letting the regex rescan from every '['.
+    """
+    last_paren = text.rfind(")")
+    if last_paren == -1:
+        return False
+    first_open = None
+    for match in _BRACKETS.finditer(text):
+        i = match.start()
+        if match.group() == "[":
+            if first_open is None:
+                first_open = i
+            continue
+        if (first_open is not None and first_open <= i - 2 and text.startswith("(", i + 1)
+                and i + 2 < len(text) and text[i + 2] != ")" and last_paren >= i + 3):
+            return True
+        first_open = None
+    return False
+
+
+def contains_url(text: str) -> bool:
+    return bool(_RAW_URL.search(text)) or has_markdown_link(text)
+
+
+@lru_cache(maxsize=1024)
+def compile_keyword_pattern(keywords: Tuple[str, ...]) -> re.Pattern:
+    """Whole-word alternation for a keyword set, compiled once per distinct set"""
+    return re.compile(r'\b(?:' + '|'.join(re.escape(keyword.lower()) for keyword in keywords) + r')\b')
+
+
+def keyword_pattern(keywords: Iterable[str]) -> re.Pattern:
+    return compile_keyword_pattern(tuple(keywords))
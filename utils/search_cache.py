@@ -0,0 +1,103 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", "1024"))
+
+
+def normalize_query(search_query: str) -> str:
+    # Reddit search is case-insensitive, so "AI  Tools" and "ai tools" share an entry
+    return " ".join(search_query.lower().split())
+
+
+class SearchResultCache:
+    """
+    Process-wide cache of raw Reddit search results.
+
+    Entries are keyed by (normalized query, sort, time filter) and hold the
+    raw submission fields plus the `is_promotional` verdict, so every user
+    with an overlapping query reuses the same listing and filters it locally.
+    """
+
+    def __init__(self, maxsize: int = SEARCH_CACHE_MAXSIZE, ttl: int = SEARCH_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(search_query: str, sort: str, time_filter: str) -> Tuple[str, str, str]:
+        return (normalize_query(search_query), sort, time_filter)
+
+    def get(self, search_query: str, sort: str, time_filter: str, limit: int) -> Optional[List[Dict]]:
+        """Return cached records for the query, or None if missing or fetched with a smaller limit"""
+        key = self.make_key(search_query, sort, time_filter)
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None or entry["limit"] < limit:
+            return None
+        return entry["records"][:limit]
+
+    def set(self, search_query: str, sort: str, time_filter: str, limit: int, records: List[Dict]):
+        key = self.make_key(search_query, sort, time_filter)
+        with self._lock:
+            self._cache[key] = {"limit": limit, "records": records}
+
+    def get_or_fetch(self, search_query: str, sort: str, time_filter: str, limit: int,
+                     fetch: Callable[[], Tuple[List[Dict], bool]]) -> Tuple[List[Dict], bool]:
+        """
+        Return (records, complete), calling `fetch` at most once per key on a miss.
+
+        `fetch` returns (records, complete); incomplete listings (e.g. the search
+        failed halfway) are returned to the caller but never cached. Cached
+        records are always complete.
+        """
+        records = self.get(search_query, sort, time_filter, limit)
+        if records is not None:
+            with self._lock:
+                self.hits += 1
+            return records, True
+
+        key = self.make_key(search_query, sort, time_filter)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                # Another thread may have filled the entry while we waited
+                records = self.get(search_query, sort, time_filter, limit)
+                if records is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return records, True
+
+                with self._lock:
+                    self.misses += 1
+                records, complete = fetch()
+                if complete:
+                    self.set(search_query, sort, time_filter, limit, records)
+        finally:
+            # Also when fetch raises (e.g. RateLimitExhausted), which propagates to the caller
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return records, complete
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+
+search_cache = SearchResultCache()
@@ -0,0 +1,142 @@
+import copy
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from cachetools import LRUCache
+from dotenv import load_dotenv
+
+from utils.post_batch import PostBatch
+
+load_dotenv()
+
+SEMANTIC_RERANK = os.getenv("SEMANTIC_RERANK", "false").lower() in ("1", "true", "yes")
+SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Only the head of the lexical ranking is re-ranked, which bounds CPU per request
+SEMANTIC_RERANK_TOP = int(os.getenv("SEMANTIC_RERANK_TOP", "100"))
+# Share of the final similarity that comes from the embedding match
+SEMANTIC_WEIGHT = float(os.getenv("SEMANTIC_WEIGHT", "0.5"))
+SEMANTIC_BATCH_SIZE = int(os.getenv("SEMANTIC_BATCH_SIZE", "64"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "50000"))
+# Long self-posts are truncated before embedding; the model only reads ~256 tokens anyway
+SEMANTIC_MAX_CHARS = int(os.getenv("SEMANTIC_MAX_CHARS", "2000"))
+
+
+class SemanticRanker:
+    """
+    Optional re-rank of lexically relevant posts by embedding similarity.
+
+    The sentence-transformers model is loaded on first use (not at import, so
+    cold start is unaffected), pinned to CPU and dynamically quantized to int8.
+    Post embeddings are cached by submission id, so a post seen by several users
+    or several runs is embedded once. If the model cannot be loaded the ranker
+    disables itself and posts keep their lexical order.
+    """
+
+    def __init__(self, model_name: str = SEMANTIC_MODEL, enabled: bool = SEMANTIC_RERANK,
+                 cache_size: int = SEMANTIC_CACHE_SIZE):
+        self.model_name = model_name
+        self.enabled = enabled
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._embeddings: LRUCache = LRUCache(maxsize=cache_size)
+        self._queries: LRUCache = LRUCache(maxsize=1024)
+        self.hits = 0
+        self.misses = 0
+
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            print(f"Semantic re-rank disabled, sentence-transformers unavailable: {e}")
+            self.enabled = False
+            return None
+        model = SentenceTransformer(self.model_name, device="cpu")
+        model.eval()
+        # int8 weights for the Linear layers: smaller and faster on CPU, near-identical rankings
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model().encode(
+            [text[:SEMANTIC_MAX_CHARS] for text in texts],
+            batch_size=SEMANTIC_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        with self._cache_lock:
+            vector = self._queries.get(query)
+        if vector is None:
+            vector = self._encode([query])[0]
+            with self._cache_lock:
+                self._queries[query] = vector
+        return vector
+
+    def embed_posts(self, batch: PostBatch) -> np.ndarray:
+        """Embeddings for every post in the batch, encoding only ids not already cached"""
+        with self._cache_lock:
+            cached: Dict[str, np.ndarray] = {post.id: self._embeddings[post.id]
+                                             for post in batch if post.id in self._embeddings}
+        missing = [post for post in batch if post.id not in cached]
+        if missing:
+            for post, vector in zip(missing, self._encode([post.text for post in missing])):
+                cached[post.id] = vector
+            with self._cache_lock:
+                for post in missing:
+                    self._embeddings[post.id] = cached[post.id]
+        with self._cache_lock:
+            self.hits += len(batch) - len(missing)
+            self.misses += len(missing)
+        return np.stack([cached[post.id] for post in batch])
+
+    def rerank(self, batch: PostBatch, query: str, top: int = SEMANTIC_RERANK_TOP,
+               weight: float = SEMANTIC_WEIGHT) -> PostBatch:
+        """
+        Blend embedding similarity into the first `top` posts and re-sort them.
+
+        Scores are blended into copies, so Post objects shared with other users
+        (e.g. by the stream) keep their lexical scores. Posts past the window are
+        dropped: they have no embedding score, so theirs would not be comparable.
+
+        Args:
+            batch (PostBatch): Posts already filtered and sorted by score_posts
+            query (str): Company description or the user's keywords
+            top (int): Number of leading posts to re-rank and return
+            weight (float): Share of the final similarity taken from the embedding match
+
+        Returns:
+            PostBatch: Copies of the first `top` posts with blended similarity, best first
+        """
+        if not self.enabled or batch.empty or not query or not query.strip():
+            return batch
+        head = batch[:top]
+        if self.model() is None:
+            return batch
+        similarities = self.embed_posts(head) @ self.embed_query(query)
+        reranked = []
+        for post, semantic in zip(head, similarities.tolist()):
+            post = copy.copy(post)
+            post.semantic_score = semantic
+            post.similarity_score = (1 - weight) * post.similarity_score + weight * semantic
+            reranked.append(post)
+        return PostBatch(reranked).sorted()
+
+    def stats(self) -> Dict:
+        with self._cache_lock:
+            return {"enabled": self.enabled, "loaded": self._model is not None,
+                    "cached": len(self._embeddings), "hits": self.hits, "misses": self.misses}
+
+
+semantic_ranker = SemanticRanker()
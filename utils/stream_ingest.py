@@ -0,0 +1,180 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from utils.posts import post_from_record, submission_record, subreddit_subscribers
+from utils.reddit_pool import reddit_pool
+
+load_dotenv()
+
+# Candidates kept per user between flushes; older ones are dropped first
+CANDIDATE_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "500"))
+# How often the stream reloads every active user's keywords
+INDEX_REFRESH_SECONDS = int(os.getenv("STREAM_INDEX_REFRESH", "900"))
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+@dataclass
+class UserKeywords:
+    primary: List[str]
+    secondary: List[str]
+    excluded: Set[str] = field(default_factory=set)
+
+
+class KeywordIndex:
+    """
+    Inverted index from keyword tokens to the users watching them.
+
+    Each keyword is indexed under its first token. A submission is tokenized
+    once, only keywords whose first token occurs in it are checked, and a
+    phrase matches when its tokens appear contiguously.
+    """
+
+    def __init__(self, users: Dict[str, UserKeywords]):
+        self.users = users
+        # first token -> [(phrase tokens, user id)]
+        self._index: Dict[str, List] = defaultdict(list)
+        for user_id, keywords in users.items():
+            for kw in keywords.primary:
+                tokens = tokenize(kw)
+                if tokens:
+                    self._index[tokens[0]].append((tokens, user_id))
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def match(self, text: str) -> Set[str]:
+        """Return the ids of users with at least one primary keyword in the text"""
+        tokens = tokenize(text)
+        if not tokens:
+            return set()
+        joined = f" {' '.join(tokens)} "
+        matched = set()
+        for token in set(tokens):
+            for phrase, user_id in self._index.get(token, ()):
+                if user_id in matched:
+                    continue
+                if len(phrase) == 1 or f" {' '.join(phrase)} " in joined:
+                    matched.add(user_id)
+        return matched
+
+
+async def load_keyword_index(firestore_service) -> KeywordIndex:
+    """Build the index from every active user's keywords and exclusions in Firestore"""
+    users = {}
+    user_ids = await firestore_service.get_active_user_ids()
+    profiles = await asyncio.gather(*(firestore_service.get_user_profile(user_id=user_id) for user_id in user_ids))
+    for user_id, profile in zip(user_ids, profiles):
+        primary = profile.primary_keywords
+        secondary = profile.secondary_keywords
+        excluded = profile.excluded_subreddits
+        if isinstance(primary, str):
+            primary = primary.split(',')
+        if isinstance(secondary, str):
+            secondary = secondary.split(',')
+        primary = [kw.strip() for kw in primary if kw.strip()]
+        secondary = [kw.strip() for kw in secondary if kw.strip()]
+        if not primary:
+            primary, secondary = secondary, []
+        excluded_set = {s.lower() for s in excluded} if isinstance(excluded, (list, set)) else set()
+        users[user_id] = UserKeywords(primary, secondary, excluded_set)
+    return KeywordIndex(users)
+
+
+class StreamIngestor:
+    """
+    Reads r/all once and routes each submission to every user whose keywords it matches.
+
+    Reddit traffic depends on post volume rather than the number of users. Matched
+    posts land in per-user candidate queues that are drained and scored with the
+    same path as /relevant_posts (see routers.post.stream_flush_helper).
+    """
+
+    def __init__(self, index: KeywordIndex, queue_size: int = CANDIDATE_QUEUE_SIZE):
+        self.index = index
+        self.queue_size = queue_size
+        self._queues: Dict[str, Deque[Dict]] = defaultdict(lambda: deque(maxlen=self.queue_size))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.seen = 0
+        self.matched = 0
+
+    def set_index(self, index: KeywordIndex):
+        self.index = index
+
+    def route(self, record: Dict) -> List[str]:
+        """Match one raw submission record and enqueue it for every matching user"""
+        self.seen += 1
+        if record["is_promotional"] or not record["subreddit"]:
+            return []
+
+        index = self.index
+        users = [
+            user_id for user_id in index.match(f"{record['title']} {record['selftext']}")
+            if record["subreddit"].lower() not in index.users[user_id].excluded
+        ]
+        if not users:
+            return []
+        subscribers = subreddit_subscribers(record)
+        if subscribers is not None and subscribers < 100:
+            return []
+
+        post = post_from_record(record)
+        with self._lock:
+            for user_id in users:
+                self._queues[user_id].append(post)
+        self.matched += 1
+        return users
+
+    def drain(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            queue = self._queues.pop(user_id, None)
+        return list(queue) if queue else []
+
+    def requeue(self, user_id: str, posts: List[Dict]):
+        """Put drained candidates back in front of any that arrived since, e.g. after a failed write"""
+        with self._lock:
+            # When over queue_size the oldest candidates are dropped, as in route()
+            self._queues[user_id] = deque(list(posts) + list(self._queues.get(user_id, ())), maxlen=self.queue_size)
+
+    def pending_users(self) -> List[str]:
+        with self._lock:
+            return [user_id for user_id, queue in self._queues.items() if queue]
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, reddit=None):
+        """
+        Consume the r/all submission stream until stop() is called. Blocking; run it in a thread.
+        """
+        reddit = reddit or reddit_pool.dedicated_client()
+        while not self._stop.is_set():
+            try:
+                # pause_after=0 yields None whenever a poll returns nothing new, so stop() is honoured
+                for submission in reddit.subreddit("all").stream.submissions(skip_existing=True, pause_after=0):
+                    if self._stop.is_set():
+                        return
+                    if submission is None:
+                        continue
+                    self.route(submission_record(submission))
+            except Exception as e:
+                print(f"Error reading submission stream: {e}")
+                time.sleep(5)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            queued = sum(len(queue) for queue in self._queues.values())
+        return {"users": len(self.index), "seen": self.seen, "matched": self.matched, "queued": queued}
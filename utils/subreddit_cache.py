@@ -0,0 +1,91 @@
+import os
+import threading
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from prawcore.exceptions import Forbidden, NotFound, Redirect
+
+load_dotenv()
+
+SUBREDDIT_CACHE_TTL = int(os.getenv("SUBREDDIT_CACHE_TTL", "86400"))
+SUBREDDIT_CACHE_MAXSIZE = int(os.getenv("SUBREDDIT_CACHE_MAXSIZE", "20000"))
+
+
+class SubredditMetadataCache:
+    """
+    Process-wide TTL cache of subreddit metadata (display name, subscribers, over18).
+
+    PRAW fetches `/about` lazily the first time a subreddit attribute that is not
+    in the listing is read. Seeding this cache from listing data and reading it
+    instead of the PRAW object keeps a search at one listing call.
+    """
+
+    def __init__(self, maxsize: int = SUBREDDIT_CACHE_MAXSIZE, ttl: int = SUBREDDIT_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            return self._cache.get(name.lower())
+
+    def seed(self, name: str, subscribers: Optional[int] = None, over18: Optional[bool] = None):
+        """Record metadata already present in a listing without any network call"""
+        key = name.lower()
+        with self._lock:
+            entry = dict(self._cache.get(key) or {"display_name": name, "subscribers": None, "over18": None})
+            if subscribers is not None:
+                entry["subscribers"] = subscribers
+            if over18 is not None:
+                entry["over18"] = over18
+            self._cache[key] = entry
+
+    def seed_from_subreddit(self, subreddit):
+        """Seed from an already-loaded PRAW Subreddit without triggering a lazy fetch"""
+        data = vars(subreddit)
+        self.seed(subreddit.display_name, data.get("subscribers"), data.get("over18"))
+
+    def lookup(self, name: str, reddit) -> Dict:
+        """
+        Return metadata for a subreddit, fetching `/about` only when the
+        subscriber count is not cached yet.
+
+        Banned, private and missing subreddits are cached with 0 subscribers.
+        Transient failures (rate limits, timeouts, 5xx) return subscribers None
+        and are not cached, so the next lookup tries again.
+        """
+        entry = self.get(name)
+        if entry is not None and entry["subscribers"] is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        try:
+            subreddit = reddit.subreddit(name)
+            subreddit._fetch()
+            entry = {
+                "display_name": subreddit.display_name,
+                "subscribers": subreddit.subscribers or 0,
+                "over18": bool(getattr(subreddit, "over18", False)),
+            }
+        except (NotFound, Forbidden, Redirect) as e:
+            print(f"Subreddit {name} is unavailable: {e}")
+            # Banned/private/missing subreddits: cache as empty so they are not retried every post
+            entry = {"display_name": name, "subscribers": 0, "over18": None}
+        except Exception as e:
+            print(f"Error fetching subreddit metadata for {name}: {e}")
+            return {"display_name": name, "subscribers": None, "over18": None}
+
+        with self._lock:
+            self._cache[name.lower()] = entry
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = len(self._cache)
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+subreddit_cache = SubredditMetadataCache()
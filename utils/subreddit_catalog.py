@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Point this at a writable location (e.g. /tmp/subreddit_catalog.db) on read-only deployments
+CATALOG_PATH = os.getenv("SUBREDDIT_CATALOG_PATH", "subreddit_catalog.db")
+# A keyword's catalog results are answered locally for this long before a live refresh
+CATALOG_TTL_SECONDS = int(os.getenv("SUBREDDIT_CATALOG_TTL", str(7 * 24 * 3600)))
+REFRESH_INTERVAL_SECONDS = int(os.getenv("SUBREDDIT_CATALOG_REFRESH", "3600"))
+# A daemon thread does not outlive a serverless invocation, so it is off there by default;
+# stale keywords are then refreshed by the live search on the request that needs them
+BACKGROUND_REFRESH = os.getenv(
+    "SUBREDDIT_CATALOG_BACKGROUND_REFRESH", "false" if os.getenv("VERCEL") else "true"
+).lower() in ("1", "true", "yes")
+
+# Attribute names match PRAW's Subreddit so calculate_relevancy works on either
+CatalogEntry = namedtuple(
+    "CatalogEntry", ["display_name", "title", "public_description", "subscribers", "active_user_count"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subreddits (
+    name TEXT PRIMARY KEY COLLATE NOCASE,
+    title TEXT,
+    description TEXT,
+    subscribers INTEGER,
+    active_users INTEGER,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS keyword_searches (
+    keyword TEXT PRIMARY KEY,
+    searched_at REAL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS subreddits_fts USING fts5(
+    name, title, description, content='subreddits', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS subreddits_ai AFTER INSERT ON subreddits BEGIN
+    INSERT INTO subreddits_fts(rowid, name, title, description) VALUES (new.rowid, new.name, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS subreddits_ad AFTER DELETE ON subreddits BEGIN
+    INSERT INTO subreddits_fts(subreddits_fts, rowid, name, title, description) VALUES ('delete', old.rowid, old.name, old.title, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS subreddits_au AFTER UPDATE ON subreddits BEGIN
+    INSERT INTO subreddits_fts(subreddits_fts, rowid, name, title, description) VALUES ('delete', old.rowid, old.name, old.title, old.description);
+    INSERT INTO subreddits_fts(rowid, name, title, description) VALUES (new.rowid, new.name, new.title, new.description);
+END;
+"""
+
+
+def normalize_keyword(keyword: str) -> str:
+    return " ".join(keyword.lower().split())
+
+
+class SubredditCatalog:
+    """
+    On-disk catalog of subreddits answering search_subreddits locally.
+
+    Full-text search uses SQLite FTS5 over name, title and public description;
+    builds of SQLite without FTS5 fall back to LIKE matching. Each keyword
+    remembers when it was last searched live, which decides whether the
+    catalog answer is fresh enough.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, ttl: int = CATALOG_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            try:
+                self._conn.executescript(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                self.has_fts = False
+
+    def upsert(self, entries: Iterable[CatalogEntry]):
+        now = time.time()
+        rows = [(e.display_name, e.title or "", e.public_description or "", e.subscribers, e.active_user_count, now)
+                for e in entries]
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    """INSERT INTO subreddits (name, title, description, subscribers, active_users, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(name) DO UPDATE SET title=excluded.title, description=excluded.description,
+                           subscribers=excluded.subscribers, active_users=excluded.active_users,
+                           updated_at=excluded.updated_at""",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            # The live results are already in hand; failing to catalog them must not fail the search
+            print(f"Error updating subreddit catalog: {e}")
+
+    def mark_searched(self, keyword: str):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO keyword_searches (keyword, searched_at) VALUES (?, ?)",
+                    (normalize_keyword(keyword), time.time()),
+                )
+        except sqlite3.Error as e:
+            print(f"Error updating subreddit catalog: {e}")
+
+    def is_fresh(self, keyword: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT searched_at FROM keyword_searches WHERE keyword = ?", (normalize_keyword(keyword),)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def stale_keywords(self, max_age: float, limit: int = 50) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT keyword FROM keyword_searches WHERE searched_at < ? ORDER BY searched_at LIMIT ?",
+                (time.time() - max_age, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, keyword: str, limit: int) -> List[CatalogEntry]:
+        """Best catalog matches for a keyword, by text rank then subscribers"""
+        columns = "s.name, s.title, s.description, s.subscribers, s.active_users"
+        with self._lock:
+            if self.has_fts:
+                # Every word must match, in any column; quoting keeps FTS syntax out of user input
+                phrase = " ".join('"' + word.replace('"', '""') + '"' for word in keyword.split())
+                rows = self._conn.execute(
+                    f"""SELECT {columns} FROM subreddits_fts f JOIN subreddits s ON s.rowid = f.rowid
+                        WHERE subreddits_fts MATCH ? ORDER BY bm25(subreddits_fts), s.subscribers DESC LIMIT ?""",
+                    (phrase or '""', limit),
+                ).fetchall()
+            else:
+                pattern = f"%{keyword.lower()}%"
+                rows = self._conn.execute(
+                    f"""SELECT {columns} FROM subreddits s
+                        WHERE lower(s.name) LIKE ? OR lower(s.title) LIKE ? OR lower(s.description) LIKE ?
+                        ORDER BY s.subscribers DESC LIMIT ?""",
+                    (pattern, pattern, pattern, limit),
+                ).fetchall()
+        return [CatalogEntry(*row) for row in rows]
+
+    def start_background_refresh(self, refresh: Callable[[str], None], interval: int = REFRESH_INTERVAL_SECONDS):
+        """
+        Re-run live searches for keywords nearing expiry in a daemon thread, so
+        requests keep hitting the catalog instead of falling back to Reddit.
+        Does nothing when BACKGROUND_REFRESH is off.
+        """
+        if not BACKGROUND_REFRESH or (self._refresher and self._refresher.is_alive()):
+            return
+
+        def loop():
+            while True:
+                for keyword in self.stale_keywords(self.ttl / 2):
+                    try:
+                        refresh(keyword)
+                    except Exception as e:
+                        print(f"Error refreshing subreddit catalog for '{keyword}': {e}")
+                time.sleep(interval)
+
+        self._refresher = threading.Thread(target=loop, daemon=True)
+        self._refresher.start()
+
+
+_catalog: Optional[SubredditCatalog] = None
+_catalog_unavailable = False
+_catalog_lock = threading.Lock()
+
+
+def get_subreddit_catalog() -> Optional[SubredditCatalog]:
+    """
+    The shared catalog, opened on first use rather than at import. None if it
+    cannot be opened (e.g. a read-only filesystem); callers then search live.
+    """
+    global _catalog, _catalog_unavailable
+    if _catalog is None and not _catalog_unavailable:
+        with _catalog_lock:
+            if _catalog is None and not _catalog_unavailable:
+                try:
+                    _catalog = SubredditCatalog()
+                except sqlite3.Error as e:
+                    print(f"Subreddit catalog disabled, cannot open {CATALOG_PATH}: {e}")
+                    _catalog_unavailable = True
+    return _catalog
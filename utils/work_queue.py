@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CRON_QUEUE_PATH = os.getenv("CRON_QUEUE_PATH", "cron_queue.db")
+# A claimed user goes back to the queue if its worker stops heartbeating for this long
+LEASE_SECONDS = float(os.getenv("CRON_LEASE_SECONDS", "120"))
+# Attempts before a user is marked failed for the run instead of retried
+MAX_ATTEMPTS = int(os.getenv("CRON_MAX_ATTEMPTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cron_items (
+    run_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    seconds REAL,
+    last_error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (run_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS cron_items_claim ON cron_items (run_id, state, attempts);
+CREATE TABLE IF NOT EXISTS cron_user_costs (
+    user_id TEXT PRIMARY KEY,
+    seconds REAL
+);
+"""
+
+
+class WorkQueue:
+    """
+    Lease-based queue of per-user cron work, backed by SQLite.
+
+    Any number of workers (threads, processes, or machines sharing the file)
+    claim users, heartbeat while processing, and complete them. A lease that is
+    not renewed expires and the user is handed to another worker, so a crashed
+    sweep resumes with only the unfinished users.
+
+    Claims are fair: users with fewer attempts go first, then users that were
+    cheapest last time, so a few slow users can only ever hold the workers they
+    are running on instead of stalling everyone queued behind them.
+    """
+
+    def __init__(self, path: str = CRON_QUEUE_PATH, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit mode, so claim can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def enqueue(self, run_id: str, user_ids: Iterable[str]) -> int:
+        """Add users to a run; users already in the run keep their state. Returns the number added."""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cron_items (run_id, user_id, updated_at) VALUES (?, ?, ?)",
+                [(run_id, user_id, now) for user_id in user_ids],
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def claim(self, run_id: str, worker_id: str) -> Optional[str]:
+        """Lease the next user of the run to this worker, or None when nothing is claimable"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases that used their last attempt will not be retried
+                self._conn.execute(
+                    """UPDATE cron_items SET state = 'failed', lease_owner = NULL, last_error = 'lease expired', updated_at = ?
+                       WHERE run_id = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                    (now, run_id, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    """SELECT i.user_id FROM cron_items i LEFT JOIN cron_user_costs c ON c.user_id = i.user_id
+                       WHERE i.run_id = ? AND i.attempts < ?
+                         AND (i.state = 'pending' OR (i.state = 'leased' AND i.lease_expires < ?))
+                       ORDER BY i.attempts, COALESCE(c.seconds, 0), i.user_id
+                       LIMIT 1""",
+                    (run_id, self.max_attempts, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    """UPDATE cron_items SET state = 'leased', lease_owner = ?, lease_expires = ?,
+                           attempts = attempts + 1, updated_at = ?
+                       WHERE run_id = ? AND user_id = ?""",
+                    (worker_id, now + self.lease_seconds, now, run_id, row[0]),
+                )
+                self._conn.execute("COMMIT")
+                return row[0]
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, run_id: str, user_id: str, worker_id: str) -> bool:
+        """Extend the lease; False means it expired and another worker may have taken the user"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """UPDATE cron_items SET lease_expires = ?, updated_at = ?
+                   WHERE run_id = ? AND user_id = ? AND state = 'leased' AND lease_owner = ?""",
+                (now + self.lease_seconds, now, run_id, user_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, run_id: str, user_id: str, worker_id: str, seconds: float, error: Optional[str] = None):
+        """
+        Finish a leased user. Successes are done; failures go back to pending until
+        max_attempts, then stay failed for the run. The duration feeds fair scheduling.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                """UPDATE cron_items SET
+                       state = CASE WHEN ? IS NULL THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       lease_owner = NULL, lease_expires = NULL, seconds = ?, last_error = ?, updated_at = ?
+                   WHERE run_id = ? AND user_id = ? AND lease_owner = ?""",
+                (error, self.max_attempts, seconds, error, now, run_id, user_id, worker_id),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cron_user_costs (user_id, seconds) VALUES (?, ?)", (user_id, seconds)
+            )
+            self._conn.execute("COMMIT")
+
+    def unfinished(self, run_id: str) -> int:
+        """Users still pending or leased; leased ones may come back if their worker dies"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM cron_items WHERE run_id = ? AND state IN ('pending', 'leased')", (run_id,)
+            ).fetchone()
+        return row[0]
+
+    def progress(self, run_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM cron_items WHERE run_id = ? GROUP BY state", (run_id,)
+            ).fetchall()
+        return dict(rows)